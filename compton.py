@@ -1,6 +1,10 @@
 #!/usr/bin/env python
 """Simulation of the compton effect."""
 import random, pygame,math,os
+import numpy as np
+from main import compton_batch, constants
+from simulation import sample_klein_nishina
+from dan_gui import load_image
 import tkinter as tk
 from tkinter import ttk
 from tkinter import *
@@ -8,88 +12,199 @@ from tkinter import *
 SCREEN_WIDTH = 800
 SCREEN_HEIGHT = 600
 
-State = -1
-Phi = math.pi/4
-Psi = -math.pi/4
-
-def load_png(name: str):
+def load_png(name: str, size=None):
     """Charge une image et retourne un objet image"""
     fullname = name #os.path.join('data', name)
-    image = pygame.image.load(fullname)
-    if image.get_alpha is None:
-        image = image.convert()
-    else:
-        image = image.convert_alpha()
+    image = load_image(fullname, size)
     return image, image.get_rect()
 
 
-class Ball(pygame.sprite.Sprite):
-    def __init__(self, img_path, x, color=0x700090, radius=30, velocity=(5,) * 2):
-        super().__init__()
-        self.x = x
-        self.screen = pygame.display.get_surface()
-        self.radius = radius
-        self.y = (self.screen.get_height() - self.radius) / 2
-        self.color = color
-        self.image, self.rect = load_png(img_path)
-        self.image = pygame.transform.scale(self.image, (self.radius,) * 2)
-        self.rect = self.rect.move((self.x, self.y))
+class Trajectory:
+    """Positions of the photon and the electron over one scattering.
+
+    The path is computed once for given angles, velocity, screen size and
+    sprite size, then indexed by the number of frames since the start of the
+    scattering, so that any frame can be replayed. The photon comes from the
+    left edge and scatters at the center of the screen. The path ends at the
+    last frame before the photon leaves the screen by any edge.
+    """
+
+    def __init__(self, phi, psi, velocity, size, radius):
+        w, h = size
+        vx, vy = velocity
+        cx, cy = (w - radius) / 2, (h - radius) / 2
+        # Positions of the incoming photon until it reaches the center
+        incoming = np.arange(1, math.floor((w - radius) / 2 / vx) + 2) * vx
+        # Frames after the scattering until the photon leaves the screen
+        states = np.arange(math.ceil((w + h) / min(vx, vy)) + 2)
+        photon_x = cx + vx * math.cos(phi) * states
+        photon_y = cy - vy * math.sin(phi) * states
+        outside = (
+            (photon_x + radius / 2 > w)
+            | (photon_x + radius < 0)
+            | (photon_y + radius < 0)
+            | (photon_y > h)
+        )
+        if outside.any():
+            states = states[: np.argmax(outside)]
+
+        self.scattering = len(incoming)
+        self.photon_x = np.concatenate([incoming, photon_x[states]]).astype(int)
+        self.photon_y = np.concatenate(
+            [np.full(len(incoming), cy), photon_y[states]]
+        ).astype(int)
+        self.electron_x = np.concatenate(
+            [np.full(len(incoming), cx), cx + vx * math.cos(psi) * states]
+        ).astype(int)
+        self.electron_y = np.concatenate(
+            [np.full(len(incoming), cy), cy - vy * math.sin(psi) * states]
+        ).astype(int)
+
+    def __len__(self):
+        return len(self.photon_x)
+
+    def photon(self, frame):
+        """Return the position of the photon at a frame of the scattering."""
+        return self.photon_x[frame], self.photon_y[frame]
+
+    def electron(self, frame):
+        """Return the position of the electron at a frame of the scattering."""
+        return self.electron_x[frame], self.electron_y[frame]
+
+
+class Timeline:
+    """Independent scattering events animated together.
+
+    Each event has its start frame and the Trajectory of its angles: phi for
+    the scattered photon and psi for the electron, given by the Compton
+    formulas of main.py. The tables of all the trajectories are packed end to
+    end, so the positions of every event at a frame are gathered in one pass
+    from the frame counter. Events are kept once they have ended, so any frame
+    can be replayed or seeked, and events with the same angles share their
+    table.
+    """
+
+    def __init__(self, size, velocity=(5,) * 2, radius=30):
+        self._size = size
         self.velocity = velocity
+        self.radius = radius
+        self.frame = 0
+        # Start frame and index of the trajectory of each event
+        self.start = np.zeros(0, dtype=int)
+        self.path = np.zeros(0, dtype=int)
+        # Trajectories and the index of each one by (phi, psi)
+        self.trajectories = []
+        self.index = {}
+        self.pack()
 
-
-class Electron(Ball):
-    def __init__(self, x, color=0x700090, radius=30,velocity=(5,)*2):
-        super().__init__(
-            "img/electron.png", x, color=color, radius=radius, velocity=velocity
+    @property
+    def size(self):
+        return self._size
+
+    @size.setter
+    def size(self, size):
+        """Compute every trajectory again for the new screen size."""
+        if size != self._size:
+            self._size = size
+            self.trajectories = [
+                Trajectory(phi, psi, self.velocity, size, self.radius) for phi, psi in self.index
+            ]
+            self.pack()
+
+    def pack(self):
+        """Pack the tables of the trajectories end to end."""
+        self.lengths = np.array([len(t) for t in self.trajectories], dtype=int)
+        self.offsets = np.concatenate([[0], np.cumsum(self.lengths)[:-1]]).astype(int)
+        self.table = np.array(
+            [
+                np.concatenate([getattr(t, name) for t in self.trajectories] or [[]])
+                for name in ("photon_x", "photon_y", "electron_x", "electron_y")
+            ],
+            dtype=int,
         )
-        self.state=0
-    def update(self, *args, **kwargs) -> None:
-        global State  # todo
-        self.rect.x = ((self.screen.get_width() - self.radius) / 2) + self.velocity[0] * math.cos(Psi) * max(State,0)
-        self.rect.y = ((self.screen.get_height() - self.radius) / 2) - self.velocity[1] * math.sin(Psi) * max(State,0)
-
-
-
-
-class Photon (Ball):
-    def __init__(self, x, color=0x700090, radius=30,velocity=(5,)*2):
-        super().__init__("img/photon.png", x, color=color, radius=radius, velocity=velocity)
-
-    def update(self, *args, **kwargs) -> None:
-        global State
-
-        if self.rect.x + self.radius / 2 > self.screen.get_width() / 2 and State<0:
-            State = 0
-        elif self.rect.x +self.radius/2 > self.screen.get_width():
-            State = -1
-            self.rect.x = 0
-            self.rect.y = (self.screen.get_height() - self.radius) / 2
-
-        if State < 0:
-            self.rect.x += self.velocity[0]
-        else:
-            self.rect.x = ((self.screen.get_width() - self.radius) / 2) + self.velocity[0] * math.cos(Phi) * State
-            self.rect.y = ((self.screen.get_height() - self.radius) / 2) - self.velocity[1] * math.sin(Phi) * State
-            State += 1
-
-
+        # Positions of the current frame, None when they must be computed again
+        self.current = None
+
+    def __len__(self):
+        """Return the number of events that have not ended at the current frame."""
+        return int(np.count_nonzero(self.frame - self.start < self.lengths[self.path]))
+
+    def add(self, phi, L0, start=None):
+        """Add events of photon angles phi in radians and incident wavelengths
+        L0 in m starting at the frames start, the current one by default.
+        Return the angles psi of the electrons."""
+        phi, L0, start = np.broadcast_arrays(
+            phi, L0, self.frame if start is None else start
+        )
+        _, _, _, psi, _ = compton_batch(phi, L0)
+        phi, psi = phi.reshape(-1), psi.reshape(-1)
+        paths = []
+        count = len(self.trajectories)
+        for key in zip(phi.tolist(), psi.tolist()):
+            if key not in self.index:
+                self.index[key] = len(self.trajectories)
+                self.trajectories.append(
+                    Trajectory(*key, self.velocity, self.size, self.radius)
+                )
+            paths.append(self.index[key])
+        self.start = np.concatenate([self.start, start.reshape(-1)])
+        self.path = np.concatenate([self.path, np.array(paths, dtype=int)])
+        # The tables are only packed again when there are new trajectories
+        if len(self.trajectories) > count:
+            self.pack()
+        self.current = None
+        return psi
+
+    def add_beam(self, count, L0, rng, spacing=5):
+        """Add count events with angles sampled from the Klein-Nishina cross
+        section, one every spacing frames."""
+        phi = sample_klein_nishina(np.full(count, constants.hc / L0), rng)
+        return self.add(phi, L0, self.frame + spacing * np.arange(count))
+
+    def positions(self, frame=None):
+        """Return the positions of the photons and the electrons of the events
+        at a frame, the current one by default, and which events are running.
+        """
+        if frame is None:
+            if self.current is None:
+                self.current = self.positions(self.frame)
+            return self.current
+        t = frame - self.start
+        lengths = self.lengths[self.path]
+        running = (t >= 0) & (t < lengths)
+        rows = self.offsets[self.path] + np.clip(t, 0, lengths - 1)
+        photon_x, photon_y, electron_x, electron_y = self.table[:, rows]
+        return photon_x, photon_y, electron_x, electron_y, running
+
+    def seek(self, frame):
+        """Go to a frame."""
+        self.frame = frame
+        self.current = None
+
+    def update(self):
+        """Go to the next frame."""
+        self.seek(self.frame + 1)
 
 
 class Main():
 
-    def __init__(self):
+    def __init__(self, phi=math.pi/4, L0=10 ** (-11), radius=30):
         pygame.init()
         self.screen = pygame.display.set_mode((SCREEN_WIDTH,SCREEN_HEIGHT))#, flags=pygame.RESIZABLE)
         pygame.display.set_caption("Effet Compton")
         pygame.display.set_icon(pygame.image.load("img/photon.png").convert())
+        self.photon_image = load_png("img/photon.png", (radius,) * 2)[0]
+        self.electron_image = load_png("img/electron.png", (radius,) * 2)[0]
+        self.rng = np.random.default_rng()
+
+        # Angles of the scattering shown by the guide lines
+        self.phi = phi
+        self.L0 = L0
+        self.timeline = Timeline(self.screen.get_size(), radius=radius)
+        self.psi = float(self.timeline.add(phi, L0)[0])
         self.make_background()
-
-        self.photon = Photon(0)
-        self.electron = Electron(0)
         pygame.display.flip()
 
-        self.all_sprites_list = pygame.sprite.Group([self.photon, self.electron])
-
     @property
     def w(self):
         return self.screen.get_width()
@@ -99,33 +214,51 @@ class Main():
         return self.screen.get_height()
 
     def make_background(self):
+        """Draw the background and the guide lines of the angles once."""
         self.background = pygame.Surface(self.screen.get_size())
         self.background = self.background.convert()
         self.background.fill(0xffffff)
         pygame.draw.line(self.background, (0,)*3, (0, self.h/2), (self.w, self.h/2))
+        self.draw_lines(self.background)
+        # The background is drawn again only when one of these changes
+        self.background_key = (self.screen.get_size(), self.phi, self.psi)
         self.screen.blit(self.background, (0, 0))
 
-    def draw_lines(self):
-        lengthPhi = self.h/(2*math.sin(Phi))
-        endPosPhi=(lengthPhi*math.cos(Phi)+self.w/2,0)
-        pygame.draw.line(self.screen, (0,)*3, (self.w/2, self.h/2), endPosPhi)
-
-        lengthPsi = self.h / (2 * math.sin(Psi))
-        end_posPsi = (lengthPhi*math.cos(Psi)+self.w/2,self.h)
-        pygame.draw.line(self.screen, (0,)*3, (self.w/2, self.h/2), end_posPsi)
-
-
+    def draw_lines(self, surface):
+        lengthPhi = self.h/(2*math.sin(self.phi))
+        endPosPhi=(lengthPhi*math.cos(self.phi)+self.w/2,0)
+        pygame.draw.line(surface, (0,)*3, (self.w/2, self.h/2), endPosPhi)
+
+        lengthPsi = self.h / (2 * math.sin(self.psi))
+        end_posPsi = (lengthPhi*math.cos(self.psi)+self.w/2,self.h)
+        pygame.draw.line(surface, (0,)*3, (self.w/2, self.h/2), end_posPsi)
+
+    def draw_events(self):
+        """Draw the photons and the electrons of every event in one call."""
+        photon_x, photon_y, electron_x, electron_y, running = self.timeline.positions()
+        sequence = []
+        for image, xs, ys in (
+            (self.electron_image, electron_x, electron_y),
+            (self.photon_image, photon_x, photon_y),
+        ):
+            positions = zip(xs[running].tolist(), ys[running].tolist())
+            sequence += [(image, position) for position in positions]
+        self.screen.blits(sequence, doreturn=False)
 
     def __call__(self, *args, **kwargs):
         game_exit = False
         clock = pygame.time.Clock()
         while not game_exit:
             clock.tick(60)
-            #self.screen.blit(self.background, self.electron)
-            self.make_background()
-            self.draw_lines()
-            self.all_sprites_list.draw(self.screen)
-            self.all_sprites_list.update()
+            if self.background_key != (self.screen.get_size(), self.phi, self.psi):
+                self.make_background()
+            else:
+                self.screen.blit(self.background, (0, 0))
+            self.timeline.size = self.screen.get_size()
+            if not len(self.timeline):
+                self.timeline.add(self.phi, self.L0)
+            self.draw_events()
+            self.timeline.update()
 
             pygame.display.flip()
             events = pygame.event.get()
@@ -134,6 +267,9 @@ class Main():
                 if event.type == pygame.QUIT:
                     pygame.quit()
                     game_exit = True
+                # b sends a beam of photons with angles following Klein-Nishina
+                elif event.type == pygame.KEYDOWN and event.key == pygame.K_b:
+                    self.timeline.add_beam(100, self.L0, self.rng)
 
 
 
@@ -1,5 +1,6 @@
 import pygame
 import math
+from collections import OrderedDict
 
 # RGB colour definitions for referring to later
 black = (0, 0, 0)
@@ -9,6 +10,83 @@ darkGrey = (50, 50, 50)
 light_grey = (130, 130, 130)
 
 
+# Dictionary with a maximum size that removes the least recently used item when full
+class LRUCache:
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.items = OrderedDict()
+
+    # Returns the item of key, calling make() to create it if it is not stored
+    def get(self, key, make):
+        if key in self.items:
+            # Marks the item as the most recently used one
+            self.items.move_to_end(key)
+            return self.items[key]
+        item = make()
+        self.items[key] = item
+        while len(self.items) > self.max_size:
+            self.items.popitem(last=False)
+        return item
+
+    def __len__(self):
+        return len(self.items)
+
+    def clear(self):
+        self.items.clear()
+
+
+# Cache of the images loaded from disk, shared by every element that displays an image
+# Images are keyed by file path, target size and whether they keep an alpha channel
+# The surfaces are shared, so they must not be drawn on
+class ImageCache(LRUCache):
+
+    def __init__(self, max_size=256):
+        LRUCache.__init__(self, max_size)
+
+    # Returns the image at path, scaled to size (a tuple of 2 integers) if size is not None
+    # The image is converted to the display format once a display mode has been set
+    def load(self, path, size=None, alpha=True):
+        return self.get((path, size, alpha), lambda: self.make(path, size, alpha))
+
+    def make(self, path, size, alpha):
+        if size is not None:
+            # Scaled variants are made from the cached full size image
+            return pygame.transform.scale(self.load(path, None, alpha), size)
+        image = pygame.image.load(path)
+        if pygame.display.get_surface() is not None:
+            image = image.convert_alpha() if alpha else image.convert()
+        return image
+
+
+# Cache of the text objects rendered by the elements
+# Text objects are keyed by font, text, antialiasing and colour
+# Hovering and dragging re-render the same few strings, which are then only rendered once
+class TextCache(LRUCache):
+
+    def __init__(self, max_size=1024):
+        LRUCache.__init__(self, max_size)
+
+    def render(self, font, text, antialias, colour):
+        key = (font, text, bool(antialias), tuple(colour))
+        return self.get(key, lambda: font.render(text, antialias, colour))
+
+
+# Caches used by all elements
+image_cache = ImageCache()
+text_cache = TextCache()
+
+
+# Loads an image through the shared cache
+def load_image(path, size=None, alpha=True):
+    return image_cache.load(path, size, alpha)
+
+
+# Renders text through the shared cache, takes the same parameters as pygame's Font.render
+def render_text(font, text, antialias, colour):
+    return text_cache.render(font, text, antialias, colour)
+
+
 # Base/parent class used for all other classes
 # Should be treated as abstract - there should never be an Element object, only objects that are children of Element
 class Element:
@@ -19,6 +97,10 @@ class Element:
     # bg_colour = The colour of background parts of the element as an RGB tuple
     # text_colour = The colour of text of the element as an RGB tuple
     def __init__(self, x, y, width, height, font, back_colour=grey, text_colour=black):
+        # dirty is True when the element looks different from when it was last drawn by a Group
+        self.dirty = True
+        # drawn_rect is the area covered by the element when it was last drawn by a Group
+        self.drawn_rect = None
         # x and y can be a decimal value as these are not the values used in drawing
         self.x = x
         self.y = y
@@ -46,8 +128,20 @@ class Element:
             if n > 255 or n < 0:
                 valid = False
         if valid:
+            if getattr(self, "_bg_colour", None) != new_colour:
+                self.dirty = True
             self._bg_colour = new_colour
 
+    # Method that marks the element to be redrawn by the Group that contains it
+    # Called by the elements whenever their value, hover or focus changes
+    def mark_dirty(self):
+        self.dirty = True
+
+    # Returns a Pygame Rect object covering everything the draw method draws
+    # Slightly larger than rect to include the borders
+    def bounds(self):
+        return self.rect.inflate(4, 4)
+
     # Default methods, child classes override the ones they need
     # Uses 'pass' keyword: method does nothing
 
@@ -84,6 +178,11 @@ class Element:
     def on_menu_add(self):
         pass
 
+    # Returns True when update must be run even if the mouse is not on the element
+    # Eg. a button counting down the frames since it was last clicked
+    def busy(self):
+        return False
+
 
 # Class for a drop-down list that displays a list of pre-defined options
 # Inherits all methods and attributes from Element
@@ -100,7 +199,7 @@ class DropDown(Element):
         self.bg_colour = light_grey
         self.data = data
         self.current_opt = 0
-        self.button_text = self.font.render(self.data[self.current_opt], 1, black)
+        self.button_text = render_text(self.font, self.data[self.current_opt], 1, black)
         # Make text objects for all data objects
         self.options = data
         # Open is a boolean that tracks whether the list should be drawn
@@ -123,6 +222,7 @@ class DropDown(Element):
             if self.button_rect.collidepoint(mouse_x, mouse_y):
                 # Closes the drop down menu
                 self.open = False
+                self.mark_dirty()
             # If clicking the menu, select the option they clicked on, then close the menu
             if self.menu_rect.collidepoint(mouse_x, mouse_y):
                 self.select_option(mouse_y)
@@ -134,6 +234,7 @@ class DropDown(Element):
             if self.button_rect.collidepoint(mouse_x, mouse_y):
                 # Open the drop down menu
                 self.open = True
+                self.mark_dirty()
         return changed
 
     # Using property modifier for getter and setter
@@ -148,11 +249,12 @@ class DropDown(Element):
         options = []
         # For each string in data, make a text object from it
         for i in range(len(data)):
-            text = self.font.render(data[i], 1, black)
+            text = render_text(self.font, data[i], 1, black)
             options.append(text)
         self.__options = options
         # Recreates the collision Rect object to account for longer menu box
         self.menu_rect = pygame.Rect(self.x, self.y2, self.width, self.height * (len(self.data)))
+        self.mark_dirty()
 
     # Takes in the y co-ord of the mouse
     # Subtracts from the y co-ord so the top of the first option box is at 0
@@ -164,7 +266,15 @@ class DropDown(Element):
 
     # Changes the text in the button to string new_text
     def change_text(self, new_text):
-        self.button_text = self.font.render(new_text, 1, black)
+        self.button_text = render_text(self.font, new_text, 1, black)
+        self.mark_dirty()
+
+    # Includes the button and the list when it is open
+    def bounds(self):
+        rect = self.rect.union(self.button_rect)
+        if self.open:
+            rect = rect.union(self.menu_rect)
+        return rect.inflate(4, 4)
 
     # Draws the drop-down box
     def draw(self, screen):
@@ -204,7 +314,7 @@ class Button(Element):
         Element.__init__(self, x, y, self.width, self.height, font)
         self.bg_colour = light_grey
         # Makes a text object of the label text
-        self.txt_obj = self.font.render(self.text, 1, self.text_colour)
+        self.txt_obj = render_text(self.font, self.text, 1, self.text_colour)
         # Clicked is a boolean value which is true when the user has clicked on the button
         self.clicked = False
         # The number of frames since the button was last clicked
@@ -225,6 +335,7 @@ class Button(Element):
     def grey(self, new_grey):
         self._grey = new_grey
         self.update_grey()
+        self.mark_dirty()
 
     # When mouse button released, clicked = false
     def on_unclick(self):
@@ -243,12 +354,20 @@ class Button(Element):
     def on_hover(self, mouse_x, mouse_y):
         # If in button, make border thicker and make background slightly lighter
         if self.rect.collidepoint(mouse_x, mouse_y) and not self.grey:
-            self.border = 2
+            border = 2
             self.bg_colour = (100, 100, 100)
         # If not in button, set border and colour back to normal
         else:
-            self.border = 1
+            border = 1
             self.bg_colour = light_grey
+        # Only redrawn when the hover state changes
+        if border != self.border:
+            self.border = border
+            self.mark_dirty()
+
+    # The button is busy while counting down the frames since it was last clicked
+    def busy(self):
+        return self.last_click != 0
 
     # Called every second
     def update(self, mouse_x, mouse_y):
@@ -268,7 +387,7 @@ class Button(Element):
             # ImageButton has no text attribute
             try:
                 self.text_colour = darkGrey
-                self.txt_obj = self.font.render(self.text, 1, self.text_colour)
+                self.txt_obj = render_text(self.font, self.text, 1, self.text_colour)
             except AttributeError:
                 pass
         # If not grey, set background colour and text colour to normal
@@ -276,7 +395,7 @@ class Button(Element):
             self.bg_colour = light_grey
             try:
                 self.text_colour = black
-                self.txt_obj = self.font.render(self.text, 1, self.text_colour)
+                self.txt_obj = render_text(self.font, self.text, 1, self.text_colour)
             except AttributeError:
                 pass
         
@@ -299,7 +418,7 @@ class ImageButton(Button):
         # Tries to open the image specified by 'filepath' in the /img folder
         # The root of the /img folder is the folder where this .py file is
         try:
-            self.image = pygame.image.load("img/" + filepath + ".png")
+            self.image = load_image("img/" + filepath + ".png")
         # Validation: Tell user if image cannot be found
         except FileNotFoundError:
             print("Could not find file at img/" + filepath + ".png")
@@ -346,8 +465,12 @@ class Slider(Element):
         self.pointer = self.x + (self.width * self.starting_pos)
         # Value is the output of the slider
         self.value = self.get_pos()
+        # shown_value is the value rounded to dec_points, as drawn above the pointer
+        self.shown_value = self.round_value()
         # txt is the text object that renders the value of the slider
         self.txt = self.update_txt()
+        # subscribers is the list of functions called with the rounded value when it changes
+        self.subscribers = []
         # true when the slider itself is clicked
         self.clicked = False
         # true when the pointer is clicked
@@ -361,9 +484,11 @@ class Slider(Element):
         self.line_y = self.y + (self.height * 0.8)
         self.pointer = self.x + (self.width * self.starting_pos)
         self.value = self.get_pos()
+        self.shown_value = self.round_value()
         self.rect = pygame.Rect(self.x, self.y, self.width, self.height)
         self.tri_rect = pygame.Rect(self.pointer - 10, self.y + 2, 20, (self.line_y - 2) - (self.y + 2))
-        self.update_txt()
+        self.txt = self.update_txt()
+        self.mark_dirty()
 
     # Given the raw pointer position relative to the top left corner of the screen
     # Gets the value from the slider and returns it
@@ -378,13 +503,24 @@ class Slider(Element):
         pos += self.limits[0]
         return pos
 
+    # Returns the value rounded to the number of decimal points the text renders
+    def round_value(self):
+        if self.dec_points == 0:
+            return round(self.value)
+        return round(self.value, self.dec_points)
+
     # Updates the text object of the value above the pointer
     def update_txt(self):
-        if self.dec_points == 0:
-            txt = self.font.render(str(round(self.value)), 1, black)
-        else:
-            txt = self.font.render(str(round(self.value, self.dec_points)), 1, black)
-        return txt
+        return render_text(self.font, str(self.shown_value), 1, black)
+
+    # Adds a function to call with the rounded value every time it changes
+    # It is called at most once a frame, when the slider is updated
+    def subscribe(self, subscriber):
+        self.subscribers.append(subscriber)
+
+    # Removes a function added with subscribe
+    def unsubscribe(self, subscriber):
+        self.subscribers.remove(subscriber)
 
     def draw(self, screen):
         # Draws bottom line
@@ -393,8 +529,6 @@ class Slider(Element):
         pygame.draw.polygon(screen, black, ((self.pointer, self.line_y - 2), (self.pointer - 10, self.y + 2),
                                                 (self.pointer + 10, self.y + 2)))
         # Draws value above pointer
-        self.value = self.get_pos()
-        self.txt = self.update_txt()
         screen.blit(self.txt, (self.pointer + 12, self.y))
 
     # If clicked and is in bounds of the triangle, clicked = True
@@ -413,39 +547,47 @@ class Slider(Element):
     # Requires both co-ords but sets y to None as default to allow overriding of method of same name in Element
     def update(self, mouse_x, mouse_y=None):
         if self.tri_clicked or self.clicked:
-            # If mouse x co-ord further than upper boundary
-            if mouse_x > self.x2:
-                # Pointer = upper boundary
-                self.pointer = self.x2
-            # If mouse x co-ord further than lower boundary
-            elif mouse_x < self.x:
-                # Pointer = lower boundary
-                self.pointer = self.x
-            # Otherwise, mouse x co-ord is between the 2 boundaries
-            # pointer = mouse x co-ord
-            else:
-                self.pointer = mouse_x
+            # The pointer is kept between the 2 boundaries
+            pointer = min(max(mouse_x, self.x), self.x2)
+            # Nothing to do while the mouse is held still
+            if pointer == self.pointer:
+                return
+            self.pointer = pointer
             self.tri_rect = pygame.Rect(self.pointer - 10, self.y + 2, 20, (self.line_y - 2) - (self.y + 2))
+            self.value = self.get_pos()
+            self.mark_dirty()
+            # The text is only rendered again and the subscribers only called when the rounded value changes
+            shown_value = self.round_value()
+            if shown_value != self.shown_value:
+                self.shown_value = shown_value
+                # Updates the text now so that bounds covers the new text
+                self.txt = self.update_txt()
+                for subscriber in self.subscribers:
+                    subscriber(shown_value)
+
+    # Includes the value drawn on the right of the pointer
+    def bounds(self):
+        return self.rect.union(self.txt.get_rect(topleft=(self.pointer + 12, self.y))).inflate(24, 4)
 
 
 # Class for a text entry box
 # Inherits all methods and attributes from Element
 class Textbox(Element):
 
-    # Static tuple of pygame character codes that have a different key_name than a letter
-    # Eg. key_name of the g key is g, therefore not included in tuple
-    special_chars = ("space", "escape", "left ctrl", "right ctrl", "return", "left alt", "right alt", "caps lock",
+    # Static set of pygame character codes that have a different key_name than a letter
+    # Eg. key_name of the g key is g, therefore not included in set
+    # Sets are used so that checking a key on every keystroke does not loop through them
+    special_chars = frozenset(("space", "escape", "left ctrl", "right ctrl", "return", "left alt", "right alt", "caps lock",
                      "numlock", "scroll lock", "tab", "left super", "right super", "menu", "f1", "f2", "f3", "f4", "f5",
                      "f6", "f7", "f8", "f9", "f10", "f11", "f12", "insert", "home", "delete", "end", "page up",
-                     "page down", "pause")
+                     "page down", "pause"))
     # Dictionary of the keys that have different characters when shift is pressed with them
     # and the corresponding characters
     shifts = {"1": "!", "2": "\"", "3": "£", "4": "$", "5": "%", "6": "^", "7": "&", "8": "*", "9": "(", "0": ")",
               "-": "_", "=": "+", "#": "~", "[": "{", "]": "}", ";": ":", "'": "@", ",": "<", ".": ">", "/": "?",
               "\\": "|"}
     # Just gets the keys from the shifts dictionary
-    # tuple of numbers 0 - 9
-    shift_keys = shifts.keys()
+    shift_keys = frozenset(shifts)
     # Static variable that holds the total number of text boxes in the program
     # Used in checking which text box is in focus
     # A text box must be in focus in order to register keyboard input
@@ -455,12 +597,12 @@ class Textbox(Element):
     # char_limit = the maximum number of characters allowed in the textbox
     def __init__(self, x, y, width, height, font, blocked_chars, char_limit = None):
         Element.__init__(self, x, y, width, height, font)
-        self.blocked_chars = blocked_chars
+        self.blocked_chars = frozenset(blocked_chars)
         self.charLimit = char_limit
         # text is a string that holds the characters input to the text box
         self.text = ""
         # txt_obj is a text object used for rendering the input
-        self.txt_obj = font.render(self.text, 1, black)
+        self.txt_obj = render_text(font, self.text, 1, black)
         self.update_text()
         # Adds one to the count of text boxes
         Textbox.TextBoxes += 1
@@ -474,11 +616,14 @@ class Textbox(Element):
 
     # If the user clicks on the text box, it is in focus
     # If the user hasn't clicked on the text box, defocuses it to prevent multiple text boxes in focus at one time
+    # Key releases only go to the focused text box, so shift is released when focus is lost
     def on_click(self, mouse_x, mouse_y):
-        if self.rect.collidepoint(mouse_x, mouse_y):
-            self.is_focused = True
-        else:
-            self.is_focused = False
+        is_focused = self.rect.collidepoint(mouse_x, mouse_y)
+        if is_focused != self.is_focused:
+            self.is_focused = is_focused
+            self.mark_dirty()
+        if not is_focused:
+            self.shift_pressed = False
 
     # Called every time a key is pressed
     def on_char_typed(self, key_pressed):
@@ -492,38 +637,20 @@ class Textbox(Element):
                 self.shift_pressed = True
             # Checks the character limit has not been reached
             elif len(self.text) < self.charLimit:
-                # is_allowed is True by default, if the key input is a blocked char, it become false
-                is_allowed = True
-                # is_special is False by default
-                # If key input is a special character (from special_chars list) then it is True
-                is_special = False
                 # key_name gets the name of the corresponding pygame key code
                 # for alphanumeric characters, is the same as the character itself
                 key_name = pygame.key.name(key_pressed)
-                # Checking if character is blocked
-                for c in self.blocked_chars:
-                    if key_name == c:
-                        is_allowed = False
-                        break
-                # Checking if character is special
-                for s in Textbox.special_chars:
-                    if key_name == s:
-                        is_special = True
-                        break
+                # is_allowed is False if the key input is a blocked char
+                is_allowed = key_name not in self.blocked_chars
+                # is_special is True if key input is a special character (from special_chars set)
+                is_special = key_name in Textbox.special_chars
                 # If the character is allowed and isn't a special character, it can be added normally
                 if is_allowed and not is_special:
                     # If the shift key is being held down
                     if self.shift_pressed:
-                        # is_shift_key is False by default but becomes true if
-                        # the key being pressed is the shift_keys list
-                        is_shift_key = False
-                        # Checks through the shift_keys list for the key being pressed
-                        for k in Textbox.shift_keys:
-                            if key_name == k:
-                                is_shift_key = True
-                        # If the key is in shift_key, use that key's shift equivalent
+                        # If the key is in shift_keys, use that key's shift equivalent
                         # Add it to the text string
-                        if is_shift_key:
+                        if key_name in Textbox.shift_keys:
                             self.text = self.text + Textbox.shifts[key_name]
                         # If not in shift_keys, just add the uppercase equivalent of the letter typed
                         else:
@@ -560,7 +687,8 @@ class Textbox(Element):
 
     # Called when the text in the text box is updated, recreates the text object
     def update_text(self):
-            self.txt_obj = self.font.render(self.text, 1, black)
+            self.txt_obj = render_text(self.font, self.text, 1, black)
+            self.mark_dirty()
 
     @property
     def text(self):
@@ -597,6 +725,7 @@ class ColourPatch(Element):
                 valid = False
         if valid:
             self._rgb = new_rgb
+            self.mark_dirty()
         else:
             print("RGB colour must be between 0 and 255")
     
@@ -616,6 +745,9 @@ class ColourPatch(Element):
 # as all Element objects have an update method
 class Group(Element):
 
+    # Static constant for the size in pixels of the cells of the grid used to find the elements under the mouse
+    cell_size = 64
+
     def __init__(self, x, y, width, height, font):
         Element.__init__(self, x, y, width, height, font)
         # visible - whether to draw the elements or not
@@ -627,6 +759,49 @@ class Group(Element):
         # texts is a two-dimensional list that stores pygame text objects
         # and the co-ords where each object should be drawn
         self.texts = [[], []]
+        # surface is where the group is drawn before being copied to the screen
+        # Only the parts of it covered by dirty elements are drawn again
+        self.surface = None
+        # area is the Rect of the surface that is copied to the screen
+        self.area = self.bounds()
+        # shown is True when the group was visible on the last call of draw
+        self.shown = False
+        # focused is the element that receives the keyboard input, None if there is none
+        self.focused = None
+        # pressed is the list of elements that received the last click
+        # Only they receive the next unclick
+        self.pressed = []
+        # active is the list of elements that were updated on the last frame
+        self.active = []
+        # grid is a dictionary of the cells of the screen and the elements whose bounds overlap them
+        # Only the elements in the cell of the mouse need to be checked for collision
+        self.grid = {}
+        # indexed is a dictionary of the elements and the bounds they were added to the grid with
+        self.indexed = {}
+        # order is a dictionary of the elements and their position in the elements list
+        self.order = {}
+
+    # A group is dirty when it has to be drawn again entirely or when one of its elements is dirty
+    @property
+    def dirty(self):
+        return self._dirty or any(element.dirty for element in self.elements)
+
+    @dirty.setter
+    def dirty(self, new_dirty):
+        self._dirty = new_dirty
+
+    # A group is in focus when one of its elements is
+    # Lets a group be added to another group like any other element
+    @property
+    def is_focused(self):
+        return self.focused is not None
+
+    # Covers the group and all its elements
+    def bounds(self):
+        rect = self.rect.inflate(4, 4)
+        for element in getattr(self, "elements", []):
+            rect = rect.union(element.bounds())
+        return rect
 
     # Adds an element (any object that inherits the Element class) to the group
     def add(self, element):
@@ -641,46 +816,165 @@ class Group(Element):
             element.on_menu_add()
             # Add object to elements list
             self.elements.append(element)
+            self.on_element_add(element)
+            self.mark_dirty()
         except AttributeError:
             print("Error: Tried adding a non-element object to a group")
 
+    # Called once an element is in the elements list
+    # An element that starts in focus, like the first text box, receives the keyboard input
+    def on_element_add(self, element):
+        self.order[element] = len(self.order)
+        self.index(element)
+        if self.focused is None and getattr(element, "is_focused", False):
+            self.focused = element
+
+    # Returns the cells of the grid covered by rect
+    def cells(self, rect):
+        size = Group.cell_size
+        return [(i, j) for i in range(rect.left // size, (rect.right - 1) // size + 1)
+                for j in range(rect.top // size, (rect.bottom - 1) // size + 1)]
+
+    # Puts the element in the cells covered by its bounds
+    # Called again whenever the element may have moved or changed size
+    def index(self, element):
+        rect = element.bounds()
+        old = self.indexed.get(element)
+        if old == rect:
+            return
+        if old is not None:
+            for cell in self.cells(old):
+                self.grid[cell].remove(element)
+        for cell in self.cells(rect):
+            self.grid.setdefault(cell, []).append(element)
+        self.indexed[element] = rect
+
     # Adds text to render in the group, takes 2 parameters
     # text - the text to be added, in string form
     def add_text(self, text, coords):
-        self.texts[0].append(self.font.render(text, 1, (255, 0, 0)))
+        self.texts[0].append(render_text(self.font, text, 1, (255, 0, 0)))
         self.texts[1].append((coords[0] + self.x, coords[1] + self.y))
-
-    def draw(self, screen):
-        if self.visible:
-            # Draws each element in the group by calling its draw method
+        self.mark_dirty()
+
+    # Draws the group and returns a list of the Rects of the screen that changed
+    # The list can be passed to pygame.display.update
+    # Only the dirty elements are drawn again, on the cached surface, and only the changed Rects are copied to the screen
+    # A Group has no background: background is the surface drawn under the changed Rects first
+    # Without it, the old pixels of the group stay under the new ones
+    # Nothing is copied when nothing changed, so a caller that draws over the group must set dirty to True
+    def draw(self, screen, background=None):
+        if not self.visible:
+            self.shown = False
+            return []
+        # Makes a new surface the size of the screen as elements use screen co-ords
+        if self.surface is None or self.surface.get_size() != screen.get_size():
+            self.surface = pygame.Surface(screen.get_size(), pygame.SRCALPHA)
+            self._dirty = True
+        if self._dirty:
+            changed = [self.surface.get_rect()]
+        else:
+            # Each dirty element covers where it was drawn and where it is now
+            changed = [element.bounds().union(element.drawn_rect or element.bounds())
+                       for element in self.elements if element.dirty]
+        for rect in changed:
+            self.compose(rect)
+        if changed:
             for element in self.elements:
-                element.draw(screen)
-            # Draws each text object in the group to the screen
-            for i in range(len(self.texts[0])):
-                screen.blit(self.texts[0][i], self.texts[1][i])
+                # A dirty element may have changed size, eg. a drop-down list that opened
+                if element.dirty:
+                    self.index(element)
+                element.dirty = False
+            self.area = self.bounds()
+        # Everything changed if the group was redrawn entirely or has just become visible
+        if self._dirty or not self.shown:
+            changed = [self.area]
+        changed = [rect.clip(screen.get_rect()) for rect in changed]
+        # Copying the same pixels again would blend the transparent edges over themselves
+        for rect in changed:
+            if background is not None:
+                screen.blit(background, rect.topleft, rect)
+            screen.blit(self.surface, rect.topleft, rect)
+        self._dirty = False
+        self.shown = True
+        return changed
 
-    def on_click(self, mouse_x, mouse_y):
-        # Runs each element's on_click method
+    # Draws again the part of the cached surface inside rect
+    def compose(self, rect):
+        self.surface.set_clip(rect)
+        self.surface.fill((0, 0, 0, 0), rect)
+        self.draw_frame(self.surface)
+        # Draws each element in the group that overlaps rect by calling its draw method
         for element in self.elements:
+            bounds = element.bounds()
+            if bounds.colliderect(rect) or (element.drawn_rect and element.drawn_rect.colliderect(rect)):
+                element.draw(self.surface)
+                element.drawn_rect = bounds
+        # Draws each text object in the group
+        for i in range(len(self.texts[0])):
+            self.surface.blit(self.texts[0][i], self.texts[1][i])
+        self.surface.set_clip(None)
+
+    # Draws what is behind the elements, a Group has nothing to draw
+    def draw_frame(self, surface):
+        pass
+
+    # Returns the list of elements that are under the mouse, in the order they were added
+    # Only the elements in the cell of the grid under the mouse are checked
+    def targets(self, mouse_x, mouse_y):
+        cell = (int(mouse_x) // Group.cell_size, int(mouse_y) // Group.cell_size)
+        targets = [element for element in self.grid.get(cell, ())
+                   if self.indexed[element].collidepoint(mouse_x, mouse_y)]
+        targets.sort(key=self.order.get)
+        return targets
+
+    def on_click(self, mouse_x, mouse_y):
+        targets = self.targets(mouse_x, mouse_y)
+        # The focused element also receives the click so that it can lose focus
+        if self.focused is not None and self.focused not in targets:
+            targets.append(self.focused)
+        # Runs the on_click method of the elements under the mouse only
+        for element in targets:
             element.on_click(mouse_x, mouse_y)
+            self.index(element)
+        self.pressed = targets
+        # The focus goes to the element that took it, if any
+        self.focused = None
+        for element in targets:
+            if getattr(element, "is_focused", False):
+                self.focused = element
+                break
 
     def on_unclick(self):
-        # Runs each element's on_unclick method
-        for element in self.elements:
+        # Runs the on_unclick method of the elements that received the click
+        for element in self.pressed:
             element.on_unclick()
+        self.pressed = []
 
+    # Keyboard input only goes to the focused element
     def on_char_typed(self, key_pressed):
-        # Runs each element's on_char_typed method
-        for element in self.elements:
-            element.on_char_typed(key_pressed)
+        if self.focused is not None:
+            self.focused.on_char_typed(key_pressed)
 
     def on_key_up(self, key_up):
-        for element in self.elements:
-            element.on_key_up(key_up)
+        if self.focused is not None:
+            self.focused.on_key_up(key_up)
 
+    # Only updates the elements under the mouse, the ones being dragged and the busy ones
+    # The elements that were under the mouse on the last frame are also updated so that they stop being hovered
     def update(self, mouse_x, mouse_y):
-        for element in self.elements:
+        hovered = self.targets(mouse_x, mouse_y)
+        active = dict.fromkeys(hovered)
+        active.update(dict.fromkeys(self.pressed))
+        active.update(dict.fromkeys(self.active))
+        for element in active:
             element.update(mouse_x, mouse_y)
+            self.index(element)
+        self.active = [element for element in active
+                       if element in hovered or element in self.pressed or element.busy()]
+
+    # A group inside another group is busy while it has elements to update
+    def busy(self):
+        return bool(self.active or self.pressed)
 
 
 # Child of the Group class
@@ -700,7 +994,7 @@ class Menu(Group):
         # y3 is the y co-ord where the main part of the menu starts and the top bar ends
         self.y3 = self.y + self.bar_height
         # Creates a pygame text object for the title
-        self.txt = self.font.render(title, 1, black)
+        self.txt = render_text(self.font, title, 1, black)
 
     # Adds an element (any object that inherits the Element class) to the menu
     # Overrides Group add method to factor in height of menu bar
@@ -716,33 +1010,36 @@ class Menu(Group):
             element.on_menu_add()
             # Add to the elements list
             self.elements.append(element)
+            self.on_element_add(element)
         except AttributeError:
             print("Error: Adding a non-element object")
 
     # Adds text to render in the menu
     # Overrides Group addText method to factor in height of menu bar
     def add_text(self, text, coords):
-        self.texts[0].append(self.font.render(text, 1, black))
+        self.texts[0].append(render_text(self.font, text, 1, black))
         self.texts[1].append((coords[0] + self.x, coords[1] + self.y + self.bar_height))
-
-    def draw(self, screen):
-        if self.visible:
-            # Draw top bar of menu
-            pygame.draw.rect(screen, (80, 80, 80), (self.x, self.y, self.width, self.bar_height))
-            # Draw title on top bar
-            screen.blit(self.txt, (self.x+2, self.y+2))
-            # Draw bg of menu
-            pygame.draw.rect(screen, (120, 120, 120), (self.x, self.y3, self.width, self.height))
-            # Draw border of menu
-            pygame.draw.lines(screen, black, True, ((self.x, self.y), (self.x, self.y2 + self.bar_height),
-                                                        (self.x2, self.y2 + self.bar_height), (self.x2, self.y)))
-            pygame.draw.line(screen, black, (self.x, self.y3), (self.x2, self.y3))
-            # Draws each element in the group by calling its draw method
-            for element in self.elements:
-                element.draw(screen)
-            # Draws each text object in the group to the screen
-            for i in range(len(self.texts[0])):
-                screen.blit(self.texts[0][i], self.texts[1][i])
+        self.mark_dirty()
+
+    # Covers the top bar, the background and the elements of the menu
+    def bounds(self):
+        rect = pygame.Rect(self.x, self.y, self.width + 1, self.height + getattr(self, "bar_height", 0) + 1)
+        for element in getattr(self, "elements", []):
+            rect = rect.union(element.bounds())
+        return rect
+
+    # The menu is opaque, so only its cached surface is needed to draw the changed Rects
+    def draw_frame(self, surface):
+        # Draw top bar of menu
+        pygame.draw.rect(surface, (80, 80, 80), (self.x, self.y, self.width, self.bar_height))
+        # Draw title on top bar
+        surface.blit(self.txt, (self.x+2, self.y+2))
+        # Draw bg of menu
+        pygame.draw.rect(surface, (120, 120, 120), (self.x, self.y3, self.width, self.height))
+        # Draw border of menu
+        pygame.draw.lines(surface, black, True, ((self.x, self.y), (self.x, self.y2 + self.bar_height),
+                                                     (self.x2, self.y2 + self.bar_height), (self.x2, self.y)))
+        pygame.draw.line(surface, black, (self.x, self.y3), (self.x2, self.y3))
 
 
 # Checkbox is a small box which when clicked will toggle between an 'on' and 'off' state
@@ -753,8 +1050,8 @@ class Checkbox(Element):
     # off_img and on_img are the images used for the off state and on state respectively
     def __init__(self, x, y, font, width=22, height=22, off_img="dan_gui/checkboxOff", on_img="dan_gui/checkboxOn"):
         Element.__init__(self, x, y, width, height, font)
-        self.offImg = pygame.image.load("img/" + off_img + ".png")
-        self.onImg = pygame.image.load("img/" + on_img + ".png")
+        self.offImg = load_image("img/" + off_img + ".png")
+        self.onImg = load_image("img/" + on_img + ".png")
         # Checkbox is off by default
         self.on = False
 
@@ -778,3 +1075,4 @@ class Checkbox(Element):
                 self.on = False
             else:
                 self.on = True
+            self.mark_dirty()
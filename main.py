@@ -1,8 +1,46 @@
 #!/usr/bin/env python
 """Simulation de l'effet compton et de l'effet photoélectrique."""
 
+import argparse
+import csv
+import functools
+import itertools
+import json
 import math
-from scipy import constants
+import os
+import pickle
+import sys
+from dataclasses import dataclass, field
+
+import numpy as np
+
+
+@dataclass(frozen=True)
+class PhysicalConstants:
+    """CODATA 2022 physical constants in SI units with precomputed products."""
+
+    h: float = 6.62607015e-34
+    c: float = 299792458.0
+    electron_mass: float = 9.1093837139e-31
+    elementary_charge: float = 1.602176634e-19
+    # h*c in J.m
+    hc: float = field(init=False)
+    # Rest energy m_e*c^2 of the electron in J
+    mec2: float = field(init=False)
+    # Value of one electron volt in J
+    electron_volt: float = field(init=False)
+    compton_wavelength: float = field(init=False)
+
+    def __post_init__(self):
+        """Compute the products from the given constants."""
+        # The dataclass is frozen, so the fields are set through object
+        object.__setattr__(self, "hc", self.h * self.c)
+        object.__setattr__(self, "mec2", self.electron_mass * self.c ** 2)
+        object.__setattr__(self, "electron_volt", self.elementary_charge)
+        object.__setattr__(self, "compton_wavelength", self.h / (self.electron_mass * self.c))
+
+
+constants = PhysicalConstants()
 
 def isfloat(value):
     try:
@@ -42,29 +80,397 @@ def getInt(min_, max_, txt=""):
         print("{} n'est pas un nombre entier entre {} et {}".format(result, min_, max_))
 
 
+def compton_batch(phi, L0):
+    """Compute the Compton scattering of arrays of angles and wavelengths.
+
+    phi is the scattering angle of the photon in radians and L0 the wavelength
+    of the incident photon in meters, both broadcast together with numpy rules.
+    Return the arrays (L1, E0, E1, psi, V): the wavelength of the scattered
+    photon, the energies of the incident and scattered photons in J, the angle
+    of the electron in radians and its speed in m/s.
+    """
+    phi, L0 = np.broadcast_arrays(
+        np.asarray(phi, dtype=float), np.asarray(L0, dtype=float)
+    )
+    LC = constants.compton_wavelength
+    Ee = constants.mec2
+
+    L1 = L0 + LC * (1 - np.cos(phi))
+    E0 = constants.hc / L0
+    E1 = constants.hc / L1
+
+    with np.errstate(divide="ignore"):
+        psi = -np.arctan(1 / ((1 + E0 / Ee) * np.tan(phi / 2)))
+    K = (Ee / (Ee + E0 - E1)) ** 2
+    V = constants.c * np.sqrt(1 - K)
+    return L1, E0, E1, psi, V
+
+
+def compton_inverse_batch(Ee, Ep, alpha, theta2, beta=1, dtype=np.float64):
+    """Compute the energy of the photons scattered by inverse Compton effect.
+
+    Ee and Ep are the energies of the electron and of the incident photon in J,
+    alpha the angle of the incident photon and theta2 the angle of the
+    scattered photon in radians and beta the speed of the electron divided by
+    c. All of them are broadcast together and converted to dtype, np.float32
+    halving the memory traffic of large scans. Return the energy of the
+    scattered photon in J.
+    """
+    Ee, Ep, alpha, theta2, beta = np.broadcast_arrays(
+        *(np.asarray(a, dtype=dtype) for a in (Ee, Ep, alpha, theta2, beta))
+    )
+    theta1 = np.subtract(math.pi, alpha, dtype=dtype)
+
+    A = Ep * one_minus_cos(theta1, beta)
+    B = one_minus_cos(theta2, beta)
+    C = one_minus_cos(theta2 - theta1) * (Ep / Ee)
+    return A / (B + C)
+
+
+def one_minus_cos(x, beta=1):
+    """Return 1 - beta*cos(x) written as (1 - beta) + 2*beta*sin(x/2)**2.
+
+    The second form does not lose its digits when x is close to 0, which keeps
+    float32 results accurate.
+    """
+    s = np.sin(x / 2)
+    return (1 - beta) + 2 * beta * s * s
+
+
+def photoelectric_batch(l, W0):
+    """Compute the photoelectric effect of arrays of wavelengths and metals.
+
+    l is the wavelength of the light in meters and W0 the work function of the
+    metal in eV. Return the arrays (emission, Ec, v, U0): whether electrons are
+    emitted, their kinetic energy in J, their speed in m/s and the stopping
+    voltage in V. Ec, v and U0 are 0 where there is no emission.
+    """
+    l, W0 = np.broadcast_arrays(np.asarray(l, dtype=float), np.asarray(W0, dtype=float))
+    W0 = W0 * constants.electron_volt
+    W = constants.hc / l
+
+    emission = W > W0
+    Ec = np.where(emission, W - W0, 0.0)
+    v = np.sqrt(2 * Ec / constants.electron_mass)
+    U0 = np.where(emission, -Ec / abs(constants.elementary_charge), 0.0)
+    return emission, Ec, v, U0
+
+
+# Work functions of the built-in metals in eV
+element = {"Cs": 1.19, "K": 2.29, "Na": 2.18, "Li": 2.39, "Zn": 4.3, "Co":3.90, "Al":4.08, "Pb":4.14, "Fe":4.50,
+           "Cu":4.7, "Ag":4.73}
+
+# Pickled dictionary {symbol: work function in eV} of the metals added by the user
+custom_metals_path = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "data", "custom_metals.dat"
+)
+
+
+class Metals:
+    """Table of the work functions of the metals sorted by work function."""
+
+    def __init__(self, custom=None):
+        """Create the table from the built-in metals and the custom ones."""
+        self.custom = dict(custom or {})
+        self.build()
+
+    def build(self):
+        """Build the sorted arrays and the index of the symbols."""
+        items = sorted({**element, **self.custom}.items(), key=lambda item: item[1])
+        self.symbols = np.array([symbol for symbol, _ in items])
+        # Work functions in eV, in increasing order
+        self.work_functions = np.array([w for _, w in items], dtype=float)
+        # Maximum wavelengths in m for which each metal emits electrons
+        self.thresholds = constants.hc / (self.work_functions * constants.electron_volt)
+        self.index = {symbol: i for i, symbol in enumerate(self.symbols.tolist())}
+
+    @classmethod
+    def load(cls, path=custom_metals_path):
+        """Load the table with the custom metals stored in path."""
+        try:
+            with open(path, "rb") as file:
+                custom = pickle.load(file)
+        except (FileNotFoundError, EOFError):
+            custom = {}
+        return cls(custom)
+
+    def save(self, path=custom_metals_path):
+        """Store the custom metals in path."""
+        with open(path, "wb") as file:
+            pickle.dump(self.custom, file)
+
+    def add(self, symbol, work_function):
+        """Add or replace a custom metal with its work function in eV."""
+        self.custom[symbol] = float(work_function)
+        self.build()
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def __iter__(self):
+        return iter(self.symbols.tolist())
+
+    def __contains__(self, symbol):
+        return symbol in self.index
+
+    def __getitem__(self, symbol):
+        """Return the work function of a metal in eV."""
+        return self.work_functions[self.index[symbol]]
+
+    def threshold(self, symbol):
+        """Return the maximum wavelength in m for which a metal emits electrons."""
+        return self.thresholds[self.index[symbol]]
+
+    def emitting(self, l):
+        """Return the metals that emit electrons at the wavelength l in m."""
+        W = constants.hc / (l * constants.electron_volt)
+        return self.symbols[: np.searchsorted(self.work_functions, W)].tolist()
+
+
+@functools.lru_cache(maxsize=None)
+def get_metals(path=custom_metals_path):
+    """Return the table of the metals, loaded only once per path."""
+    return Metals.load(path)
+
+
+# Fields of the matrix returned by photoelectric_sweep
+photoelectric_dtype = np.dtype(
+    [("emission", bool), ("Ec", float), ("v", float), ("U0", float)]
+)
+
+
+def photoelectric_sweep(l, metals=None):
+    """Compute the photoelectric effect of every wavelength on every metal.
+
+    l is an array of wavelengths in meters and metals a list of symbols of
+    the table of the metals, all of them by default in increasing order of
+    work function. Return the list of metals and a
+    (len(l), len(metals)) structured array with the fields of
+    photoelectric_dtype, one column per metal.
+    """
+    table = get_metals()
+    if metals is None:
+        metals, W0 = list(table), table.work_functions
+    else:
+        metals = list(metals)
+        W0 = np.array([table[metal] for metal in metals], dtype=float)
+    l = np.asarray(l, dtype=float).reshape(-1)
+
+    sweep = np.empty((len(l), len(metals)), dtype=photoelectric_dtype)
+    results = photoelectric_batch(l[:, np.newaxis], W0[np.newaxis, :])
+    for name, result in zip(photoelectric_dtype.names, results):
+        sweep[name] = result
+    return metals, sweep
+
+
+def batch_compton(columns):
+    """Run the Compton calculator on a chunk of rows."""
+    L1, E0, E1, psi, V = compton_batch(np.radians(columns["phi"]), columns["L0"])
+    return {"L1": L1, "E0": E0, "E1": E1, "psi": np.degrees(psi), "V": V}
+
+
+def batch_compton_inverse(columns):
+    """Run the inverse Compton calculator on a chunk of rows."""
+    Ex = compton_inverse_batch(
+        columns["Ee"],
+        columns["Ep"],
+        np.radians(columns["alpha"]),
+        np.radians(columns["theta2"]),
+        columns["beta"],
+    )
+    return {"Ex": Ex}
+
+
+def batch_photoelectric(columns):
+    """Run the photoelectric calculator on a chunk of rows."""
+    table = get_metals()
+    W0 = [table[metal] for metal in columns["metal"]]
+    emission, Ec, v, U0 = photoelectric_batch(columns["l"], W0)
+    return {"emission": emission, "Ec": Ec, "v": v, "U0": U0}
+
+
+# Calculators of the batch mode with the columns they need and the optional ones with their default
+calculators = {
+    "compton": (batch_compton, ("phi", "L0"), {}),
+    "inverse": (batch_compton_inverse, ("Ee", "Ep", "alpha", "theta2"), {"beta": 1}),
+    "photoelectric": (batch_photoelectric, ("l", "metal"), {}),
+}
+
+# Ranges of the input columns, the ones of the menu converted to the units of the batch mode
+limits = {
+    "phi": (1, 175),
+    "L0": (1e-12, 1e-9),
+    "Ee": (0, 10 ** 20),
+    "Ep": (0, 10 ** 20),
+    "alpha": (0, 90),
+    "theta2": (0, 90),
+    "beta": (0, 1),
+    "l": (100e-9, 1000e-9),
+}
+
+# Columns and units of the calculators, shown by --help
+units = """colonnes (les longueurs d'onde sont en m, et non en pm ou nm comme dans le menu) :
+  compton        phi (degrés, 1 à 175), L0 (m, 1e-12 à 1e-9)
+                 -> L1 (m), E0 (J), E1 (J), psi (degrés), V (m/s)
+  inverse        Ee (J), Ep (J), alpha (degrés, 0 à 90), theta2 (degrés, 0 à 90),
+                 beta (v/c, 0 à 1, 1 par défaut)
+                 -> Ex (J)
+  photoelectric  l (m, 1e-7 à 1e-6), metal (symbole)
+                 -> emission, Ec (J), v (m/s), U0 (V)"""
+
+
+def guess_format(path, default="csv"):
+    """Return the format of a file from its extension."""
+    if path.endswith(".jsonl") or path.endswith(".json"):
+        return "jsonl"
+    if path.endswith(".csv"):
+        return "csv"
+    return default
+
+
+def read_rows(stream, fmt):
+    """Yield the rows of a csv or jsonl stream as dictionaries."""
+    if fmt == "csv":
+        yield from csv.DictReader(stream)
+    else:
+        for line in stream:
+            if line.strip():
+                yield json.loads(line)
+
+
+def read_chunks(rows, size):
+    """Group the rows in lists of at most size rows."""
+    rows = iter(rows)
+    while True:
+        chunk = list(itertools.islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def check_column(key, values, first_row):
+    """Raise a ValueError naming the first row whose value of key is not finite or out of its range."""
+    low, high = limits.get(key, (-np.inf, np.inf))
+    wrong = ~(np.isfinite(values) & (values >= low) & (values <= high))
+    if wrong.any():
+        i = int(np.argmax(wrong))
+        raise ValueError(
+            "{} = {} hors de [{}, {}] à la ligne {}".format(key, values[i], low, high, first_row + i)
+        )
+
+
+def run_batch(name, input_stream, output_stream, input_format, output_format, chunk_size):
+    """Stream the rows of input_stream through a calculator into output_stream."""
+    function, keys, optional_keys = calculators[name]
+    metals = get_metals()
+    writer = None
+    names = None
+    # Number of the first row of the chunk, counted from 1
+    first_row = 1
+    for chunk in read_chunks(read_rows(input_stream, input_format), chunk_size):
+        columns = {}
+        for key in keys:
+            try:
+                values = [row[key] for row in chunk]
+            except KeyError:
+                raise ValueError("colonne manquante : {}".format(key))
+            if key == "metal":
+                for i, metal in enumerate(values):
+                    if metal not in metals:
+                        raise ValueError("métal inconnu {!r} à la ligne {}".format(metal, first_row + i))
+                columns[key] = values
+            else:
+                columns[key] = np.array(values, dtype=float)
+                check_column(key, columns[key], first_row)
+        # Optional columns are filled row by row with their default
+        for key, default in optional_keys.items():
+            values = [row.get(key, default) for row in chunk]
+            # Empty csv cells also take the default
+            values = [default if value in ("", None) else value for value in values]
+            columns[key] = np.array(values, dtype=float)
+            check_column(key, columns[key], first_row)
+        with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+            results = function(columns)
+        # Results that cannot be computed, such as Ex for Ee = 0, are refused like the inputs
+        for key, values in results.items():
+            if values.dtype.kind == "f" and not np.isfinite(values).all():
+                i = int(np.argmax(~np.isfinite(values)))
+                raise ValueError("{} ne peut pas être calculé à la ligne {}".format(key, first_row + i))
+        columns.update({key: value.tolist() for key, value in results.items()})
+        # The output columns are the ones of the first chunk
+        if names is None:
+            names = list(columns)
+        first_row += len(chunk)
+        if output_format == "csv":
+            if writer is None:
+                writer = csv.writer(output_stream)
+                writer.writerow(names)
+            writer.writerows(zip(*(columns[key] for key in names)))
+        else:
+            for values in zip(*(columns[key] for key in names)):
+                output_stream.write(json.dumps(dict(zip(names, values)), allow_nan=False) + "\n")
+
+
+def get_parser():
+    """Parser of the batch mode."""
+    parser = argparse.ArgumentParser(
+        description=__doc__, epilog=units, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("calculator", choices=calculators, help="calcul à effectuer")
+    parser.add_argument("--input", "-i", default="-", help="fichier csv ou jsonl d'entrée")
+    parser.add_argument("--output", "-o", default="-", help="fichier csv ou jsonl de sortie")
+    parser.add_argument("--input-format", choices=("csv", "jsonl"), help="format d'entrée")
+    parser.add_argument("--output-format", choices=("csv", "jsonl"), help="format de sortie")
+    parser.add_argument("--chunk-size", type=int, default=10 ** 5, help="nombre de lignes par bloc")
+    return parser
+
+
+def cli(argv):
+    """Run the batch mode from the command line arguments."""
+    parser = get_parser()
+    args = parser.parse_args(argv)
+    input_format = args.input_format or guess_format(args.input)
+    output_format = args.output_format or guess_format(args.output, input_format)
+    input_stream = output_stream = None
+    try:
+        input_stream = sys.stdin if args.input == "-" else open(args.input, newline="")
+        output_stream = sys.stdout if args.output == "-" else open(args.output, "w", newline="")
+        run_batch(
+            args.calculator,
+            input_stream,
+            output_stream,
+            input_format,
+            output_format,
+            args.chunk_size,
+        )
+    except (OSError, ValueError, KeyError) as error:
+        parser.error(str(error))
+    finally:
+        if input_stream not in (None, sys.stdin):
+            input_stream.close()
+        if output_stream not in (None, sys.stdout):
+            output_stream.close()
+
+
 class Main:
     def __init__(self):
         pass
 
     def compton(self, *args, **kwargs):
-        self.LC = constants.physical_constants["Compton wavelength"][0]
+        self.LC = constants.compton_wavelength
 
         print("Choisissez l'angle du photon diffusé en degré")
         self.phi = getFloat(1, 175) * math.pi / 180
         print("Choisissez la longueur d'onde du photon incident :")
         self.L0 = getFloat(1, 10 ** 3, "facteur: 10e-12 :") * 10 ** (-12)
-        self.Ee = constants.electron_mass * (constants.c ** 2)
-
-        self.L1 = self.L0 + self.LC * (1 - math.cos(self.phi))
-        self.E0 = (constants.h * constants.c) / self.L0
-        self.E1 = constants.h * constants.c / self.L1
+        self.Ee = constants.mec2
 
-        self.psi = - math.atan(1 / ((1 + self.E0 / self.Ee) * math.tan(self.phi / 2)))
-        self.K = (self.Ee / (self.Ee + self.E0 - self.E1)) ** 2
-        self.V = constants.c * math.sqrt(1 - self.K)
+        self.L1, self.E0, self.E1, self.psi, self.V = map(
+            float, compton_batch(self.phi, self.L0)
+        )
 
         E0_Kev = math.floor(
-            self.E0 / (constants.physical_constants["electron volt"][0] * 1000)
+            self.E0 / (constants.electron_volt * 1000)
         )
 
         txt = "Énergie du photon incident {E0} keV\nLongueur d'onde du photon diffusé \u03bb' = {L1} m\nAngle de l'électron  \u03B8 = {psi}°\nVitesse de l'électron Ve = {V} m/s".format(
@@ -92,13 +498,7 @@ class Main:
         print("Angle pris par le photon rétro-diffusé")
         self.theta2 = getFloat(0, 90, "degré") * (math.pi/180)
 
-        beta = 1
-
-        A = self.Ep * (1-beta*math.cos(self.theta1))
-        B = (1 - beta * math.cos(self.theta2))
-        C = (1-math.cos(self.theta2-self.theta1)) * (self.Ep/self.Ee)
-
-        self.Ex = A/(B+C)
+        self.Ex = float(compton_inverse_batch(self.Ee, self.Ep, self.alpha, self.theta2))
 
         print("Energie du photon diffusé : {} J".format(self.Ex))
 
@@ -111,40 +511,38 @@ class Main:
         print(
             "Choisissez un matériau :"
         )  # to do utiliser curses https://docs.python.org/3/howto/curses.html
-        element = {"Cs": 1.19, "K": 2.29, "Na": 2.18, "Li": 2.39, "Zn": 4.3, "Co":3.90, "Al":4.08, "Pb":4.14, "Fe":4.50,
-                   "Cu":4.7, "Ag":4.73}
-        print(",".join([e for e, _ in element.items()]))
+        metals = get_metals()
+        print(",".join(metals))
         while True:
             result = input()
-            if result in element:
+            if result in metals:
                 break
             print(
                 "{} n'est pas dans la liste : ".format(result)
-                + ",".join(element.keys())
+                + ",".join(metals)
             )
-        self.W0 = element[result]  # en eV
+        self.W0 = metals[result]  # en eV
 
-        self.W0 = self.W0 * constants.physical_constants["electron volt"][0]  # en J
-        self.W = constants.h * constants.c / self.l  # en J
-
-        if self.W <= self.W0:
+        emission, self.Ec, self.v, self.U0 = photoelectric_batch(self.l, self.W0)
+        if not emission:
             print("Il n'y a pas d'émission d'électrons")
         else:
             print("Il y a émissison d'électrons")
-            self.Ec = self.W - self.W0
-            self.v = math.sqrt(2 * self.Ec / constants.electron_mass)
             print("Vitesse des éléctrons émis : {} m/s".format(self.v))
-            self.U0 = -self.Ec / abs(constants.elementary_charge)
             print(
                 "Tension à appliquer entre le métal émissif et l’anode pour annuler le courant photoélectrique :"
             )
             print("{} V".format(self.U0))
 
 
-a = Main()
-while True:
-    print("Tapez  :\n0 pour l'effet Compton\n1 pour l'effet photoelectrique\n2 pour l'effet compton inverse")
-    choix = getInt(0, 2)
-    [a.compton, a.photoelectrique, a.comptonInverse][choix]()
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        cli(sys.argv[1:])
+        raise SystemExit
+    a = Main()
+    while True:
+        print("Tapez  :\n0 pour l'effet Compton\n1 pour l'effet photoelectrique\n2 pour l'effet compton inverse")
+        choix = getInt(0, 2)
+        [a.compton, a.photoelectrique, a.comptonInverse][choix]()
 
-input("Tapez sur enter pour quitter")
\ No newline at end of file
+    input("Tapez sur enter pour quitter")
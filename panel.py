@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+"""Control panel of the Compton and photoelectric calculators."""
+
+import os
+
+os.environ["PYGAME_HIDE_SUPPORT_PROMPT"] = "hide"
+import pygame
+import math
+import functools
+
+import dan_gui
+from main import compton_batch, photoelectric_batch, get_metals, constants
+
+
+@functools.lru_cache(maxsize=1024)
+def compton_results(phi: float, L0: float) -> tuple:
+    """Return the lines of text of the Compton scattering.
+
+    phi is the angle of the scattered photon in degrees and L0 the wavelength
+    of the incident photon in pm, both rounded like the sliders that give
+    them so that scrubbing back over a value does not compute it again.
+    """
+    L1, E0, E1, psi, V = map(float, compton_batch(math.radians(phi), L0 * 1e-12))
+    return (
+        "Énergie du photon incident E0 = {:.1f} keV".format(E0 / (constants.electron_volt * 1000)),
+        "Longueur d'onde du photon diffusé λ' = {:.4g} m".format(L1),
+        "Angle de l'électron θ = {:.1f}°".format(math.degrees(psi)),
+        "Vitesse de l'électron Ve = {:.4g} m/s".format(V),
+    )
+
+
+@functools.lru_cache(maxsize=1024)
+def photoelectric_results(l: float, metal: str) -> tuple:
+    """Return the lines of text of the photoelectric effect.
+
+    l is the wavelength of the light in nm, rounded like the slider that
+    gives it, and metal a symbol of the table of the metals.
+    """
+    W0 = float(get_metals()[metal])
+    emission, Ec, v, U0 = photoelectric_batch(l * 1e-9, W0)
+    lines = ("Travail d'extraction de {} W0 = {:.2f} eV".format(metal, W0),)
+    if not emission:
+        return lines + ("Il n'y a pas d'émission d'électrons",)
+    return lines + (
+        "Vitesse des électrons émis v = {:.4g} m/s".format(float(v)),
+        "Tension d'arrêt U0 = {:.3f} V".format(float(U0)),
+    )
+
+
+class Panel:
+    """Window with sliders bound to the results of the calculators."""
+
+    background_color = (200, 200, 200)
+    text_color = (0, 0, 0)
+    line_height = 22
+
+    def __init__(self, phi=45, L0=10, l=400, fps=60):
+        """Create the window, the menu and its widgets.
+
+        phi is in degrees, L0 in pm and l in nm, like in main.py.
+        """
+        pygame.init()
+        pygame.display.set_caption("Calculateurs")
+        self.screen = pygame.display.set_mode((900, 560))
+        self.clock = pygame.time.Clock()
+        self.fps = fps
+        self.font = pygame.font.SysFont(None, 22)
+        self.metals = list(get_metals())
+
+        self.menu = dan_gui.Menu(
+            20, 20, 300, 240 + 20 * len(self.metals), self.font, "Paramètres"
+        )
+        self.phi_slider = self.add_slider("Angle du photon diffusé φ (°)", 5, (1, 175), phi)
+        self.L0_slider = self.add_slider("Longueur d'onde incidente λ0 (pm)", 65, (1, 1000), L0)
+        self.l_slider = self.add_slider("Longueur d'onde de la lumière λ (nm)", 125, (100, 1000), l)
+        self.menu.add_text("Métal", (10, 185))
+        self.dropdown = dan_gui.DropDown(10, 205, 100, 20, self.metals, self.font)
+        self.menu.add(self.dropdown)
+        self.menu.visible = True
+        self.metal = self.metals[self.dropdown.current_opt]
+
+        # The results are shown again only when a rounded value changes
+        self.phi_slider.subscribe(lambda value: self.show_compton())
+        self.L0_slider.subscribe(lambda value: self.show_compton())
+        self.l_slider.subscribe(lambda value: self.show_photoelectric())
+
+        self.results_rect = pygame.Rect(self.menu.x2 + 20, 20, 540, 10 * self.line_height)
+        self.screen.fill(self.background_color)
+        self.dirty_rects = [self.screen.get_rect()]
+        self.show_compton()
+        self.show_photoelectric()
+
+    def add_slider(self, title: str, y: int, limits: tuple, value: float):
+        """Add a titled slider to the menu, with its pointer at value."""
+        self.menu.add_text(title, (10, y))
+        starting_pos = (value - limits[0]) / (limits[1] - limits[0])
+        slider = dan_gui.Slider(10, y + 20, 200, 30, self.font, limits, starting_pos)
+        self.menu.add(slider)
+        return slider
+
+    def __call__(self):
+        """Main loop."""
+        while True:
+            self.clock.tick(self.fps)
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    pygame.quit()
+                    raise SystemExit
+                elif event.type == pygame.KEYDOWN:
+                    if event.key == pygame.K_ESCAPE:
+                        pygame.quit()
+                        raise SystemExit
+                    self.menu.on_char_typed(event.key)
+                elif event.type == pygame.KEYUP:
+                    self.menu.on_key_up(event.key)
+                elif event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
+                    self.menu.on_click(*event.pos)
+                elif event.type == pygame.MOUSEBUTTONUP and event.button == 1:
+                    self.menu.on_unclick()
+            self.menu.update(*pygame.mouse.get_pos())
+            metal = self.metals[self.dropdown.current_opt]
+            if metal != self.metal:
+                self.metal = metal
+                self.show_photoelectric()
+            self.show()
+
+    def show(self):
+        """Show the menu and the results, updating only the rects that changed."""
+        rects = self.dirty_rects + self.menu.draw(self.screen)
+        if rects:
+            pygame.display.update(rects)
+        self.dirty_rects = []
+
+    def show_compton(self):
+        """Show the results of the Compton scattering."""
+        lines = compton_results(self.phi_slider.shown_value, self.L0_slider.shown_value)
+        self.show_lines(("Effet Compton",) + lines, 0)
+
+    def show_photoelectric(self):
+        """Show the results of the photoelectric effect."""
+        lines = photoelectric_results(self.l_slider.shown_value, self.metal)
+        self.show_lines(("Effet photoélectrique",) + lines, 5)
+
+    def show_lines(self, lines: tuple, row: int):
+        """Show lines of text in the results from the given row, clearing 5 rows."""
+        rect = pygame.Rect(
+            self.results_rect.x,
+            self.results_rect.y + row * self.line_height,
+            self.results_rect.width,
+            5 * self.line_height,
+        )
+        self.screen.fill(self.background_color, rect)
+        for i, line in enumerate(lines):
+            text = dan_gui.render_text(self.font, line, 1, self.text_color)
+            self.screen.blit(text, (rect.x, rect.y + i * self.line_height))
+        self.dirty_rects.append(rect)
+
+
+if __name__ == "__main__":
+    Panel()()
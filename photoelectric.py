@@ -5,10 +5,11 @@ import os
 
 os.environ["PYGAME_HIDE_SUPPORT_PROMPT"] = "hide"
 import pygame
-import itertools
-import argparse
+import numpy as np
 
 from rich import print
+from simulation import ParticleSystem, get_parser
+from settings import Settings, get_settings
 
 
 class Window:
@@ -42,122 +43,52 @@ class Window:
         return self.screen.get_height()
 
 
-class Particle:
-    """Particle"""
-
-    id = 0
-
-    def __init__(
-        self,
-        x: float,
-        y: float,
-        vx: float = 0,
-        vy: float = 0,
-        energy: float = 0,
-    ):
-        """Create a photon."""
-        self.position: pygame.Vector = pygame.Vector2(x, y)
-        self.velocity: pygame.Vector = pygame.Vector2(vx, vy)
-        self.energy: float = energy
-
-    def __str__(self):
-        """Return the string representation of the particle."""
-        id = type(self).id
-        name = type(self).__name__
-        rx = round(self.x, 3)
-        ry = round(self.y, 3)
-        re = round(self.energy, 3)
-        return f"{name}{n}(x={rx},y={ry},e={re})"
-
-    @property
-    def x(self):
-        return self.position.x
-
-    @property
-    def y(self):
-        return self.position.y
-
-    @property
-    def vx(self):
-        return self.velocity.x
-
-    @property
-    def vy(self):
-        return self.velocity.y
-
-
-class Photon(Particle):
-    """Photon."""
-
-    id = 0
-    plank_constant = 0
-
-    def __init__(
-        self,
-        x: float,
-        y: float,
-        vx: float = 0,
-        vy: float = 0,
-        energy: float = 0,
-        color: int = 0xFFFF77,
-        radius: float = 0.01,
-    ):
-        """Create a photon."""
-        super().__init__(x, y, vx, vy, energy)
-        self.color = color
-        self.radius = radius
-        Photon.id += 1
-
-    def update(self, dt: float):
-        """Update the photon."""
-        self.position += self.velocity * dt
-        self.energy = self.velocity.magnitude() * Photon.plank_constant
-
-    def show(self, window: Window):
-        """Show the photon."""
-        x, y = window.convert(self.x, self.y)
-        pygame.draw.circle(
-            window.screen, self.color, (x, y), self.radius * window.length
-        )
-
-
-class Electron(Particle):
-    """Electron."""
-
-    id = 0
-
-    def __init__(
-        self,
-        x: float,
-        y: float,
-        vx: int,
-        vy: int,
-        energy: float,
-        color: int,
-        radius: float,
-    ):
-        """Create a electron."""
-        super().__init__(x, y, vx, vy, energy)
-        self.color = color
-        self.radius = radius
-        Electron.id += 1
-
-    def update(self, dt: float):
-        """Update the electron."""
-        self.position += self.velocity * dt
-
-    def show(self, window: Window):
-        """Show the electron."""
-        x, y = window.convert(self.x, self.y)
-        pygame.draw.circle(
-            window.screen, self.color, (x, y), self.radius * window.length
+class SpriteRenderer:
+    """Draw particles by blitting pre-rendered circles.
+
+    One sprite is rasterized per color and radius in pixels, then all the
+    particles are drawn with a single Surface.blits call.
+    """
+
+    def __init__(self):
+        """Create a renderer with an empty cache of sprites."""
+        self.sprites = {}
+
+    def sprite(self, color: int, radius: int) -> pygame.Surface:
+        """Return the sprite of a circle of a color 0xRRGGBB and a radius."""
+        key = (color, radius)
+        if key not in self.sprites:
+            surface = pygame.Surface((2 * radius + 1,) * 2, pygame.SRCALPHA)
+            rgb = ((color >> 16) & 0xFF, (color >> 8) & 0xFF, color & 0xFF)
+            pygame.draw.circle(surface, rgb, (radius, radius), radius)
+            self.sprites[key] = surface.convert_alpha()
+        return self.sprites[key]
+
+    def clear(self):
+        """Forget the sprites, for example when the window is resized."""
+        self.sprites.clear()
+
+    def draw(self, window: Window, particles: ParticleSystem) -> list:
+        """Draw the particles and return the rects they cover."""
+        xs, ys = window.convert(particles.x, particles.y)
+        radii = np.rint(particles.radius * window.length).astype(np.int64)
+        keys = (particles.color.astype(np.int64) << 32) | radii
+        unique, inverse = np.unique(keys, return_inverse=True)
+        sprites = [self.sprite(int(key >> 32), int(key & 0xFFFFFFFF)) for key in unique]
+        lefts = np.rint(xs - radii).astype(np.int64).tolist()
+        tops = np.rint(ys - radii).astype(np.int64).tolist()
+        return window.screen.blits(
+            [
+                (sprites[k], (left, top))
+                for k, left, top in zip(inverse.tolist(), lefts, tops)
+            ]
         )
 
 
 class Main:
     """Main class."""
 
-    def __init__(self, config: argparse.Namespace):
+    def __init__(self, config: Settings):
         """Initializing the simulation."""
         pygame.init()
         pygame.display.set_caption("Effet Compton")
@@ -166,21 +97,31 @@ class Main:
         self.clock = pygame.time.Clock()
         self.background_color = config.background_color
         self.line_color = config.line_color
-        self.dt = float(config.dt)
-        self.fps = int(config.fps)
-        self.electron_energy = float(config.electron_energy)
-        Photon.plank_constant = float(config.plank_constant)
+        self.dt = config.dt
+        self.fps = config.fps
+        # Simulated time per second, one step per frame by default
+        self.time_scale = self.dt * self.fps
+        # Maximum number of steps per frame, the others are dropped
+        self.max_steps = 8
+        self.dropped_steps = 0
+        self.config = config
+        # Rects of the screen drawn at the previous frame
+        self.dirty_rects = []
+        self.renderer = SpriteRenderer()
+        self.make_background()
         self.start()
 
     def start(self):
         """Start the simulation."""
-        self.photons = (Photon(-0.5, 0, 0.005),)
-        self.electrons = (Electron(0, 0, energy=self.electron_energy),)
+        self.rng = np.random.default_rng()
+        self.particles = ParticleSystem.from_config(self.config, rng=self.rng)
+        self.accumulator = 0
         self.pause = False
 
     def __call__(self, *args, **kwargs):
         """Main loop."""
         while True:
+            elapsed = self.clock.tick(self.fps) / 1000
             events = pygame.event.get()
 
             for event in events:
@@ -191,88 +132,96 @@ class Main:
                     self.window.screen = pygame.display.set_mode(
                         event.size, flags=pygame.RESIZABLE
                     )
+                    self.make_background()
                 if event.type == pygame.KEYDOWN:
                     if event.key == pygame.K_ESCAPE or event.key == pygame.K_q:
                         pygame.quit()
                         raise SystemExit
                     elif event.key == pygame.K_o:
-                        self.dt *= 2
+                        self.time_scale *= 2
                     elif event.key == pygame.K_p:
-                        self.dt /= 2
+                        self.time_scale /= 2
                     elif event.key == pygame.K_SPACE:
                         self.pause = not self.pause
                     elif event.key == pygame.K_r:
                         self.start()
 
             if not self.pause:
-                self.update()
-                self.collide()
+                self.step(elapsed)
                 self.show()
-            self.clock.tick(self.fps)
+
+    def step(self, elapsed: float):
+        """Run the fixed steps dt that fit in elapsed seconds.
+
+        The time left is kept for the next frame. When more than max_steps
+        steps are due, the others are dropped with the time left so that the
+        window stays responsive, and their count is shown in the title.
+        """
+        self.accumulator += elapsed * self.time_scale
+        steps = int(self.accumulator // self.dt)
+        if steps > self.max_steps:
+            self.dropped_steps += steps - self.max_steps
+            pygame.display.set_caption(
+                f"Effet Compton ({self.dropped_steps} pas ignorés)"
+            )
+            steps = self.max_steps
+            self.accumulator = 0
+        else:
+            self.accumulator -= steps * self.dt
+        for _ in range(steps):
+            self.update()
+            self.collide()
 
     def collide(self):
         """Deal with particle collisions."""
-        for electron in self.electrons:
-            for photon in self.photons:
-                self.collide_electron_photon(electron, photon)
-
-    def collide_electron_photon(self, electron: Electron, photon: Photon):
-        """Deal with the collision with an electron and a photon."""
-        if (electron.position - photon.position).magnitude() < (
-            electron.radius + photon.radius
-        ):
-            p1, p2 = photon.position, electron.position
-            v1, v2 = photon.velocity, electron.velocity
-            n = (v2 - v1).magnitude()
-            photon.velocity
+        electrons, photons = self.particles.collisions()
+        if len(photons):
+            self.collide_electron_photon(electrons, photons)
+
+    def collide_electron_photon(self, electrons: np.ndarray, photons: np.ndarray):
+        """Deal with the collisions of electrons and photons given by indices."""
+        self.particles.scatter(electrons, photons, self.rng)
 
     def update(self):
         """Update the simulation."""
-        for electron in self.electrons:
-            electron.update(self.dt)
-        for photon in self.photons:
-            photon.update(self.dt)
+        self.particles.update(self.dt)
 
-    def show(self):
-        """Show the simulation."""
-        self.window.screen.fill(self.background_color)
+    def make_background(self):
+        """Draw the static background once for the current window size."""
+        self.background = pygame.Surface(self.window.screen.get_size()).convert()
+        self.background.fill(self.background_color)
         pygame.draw.line(
-            self.window.screen,
+            self.background,
             self.line_color,
             (0, self.window.height / 2),
             (self.window.width, self.window.height / 2),
         )
-        for electron in self.electrons:
-            electron.show(self.window)
-        for photon in self.photons:
-            photon.show(self.window)
-        pygame.display.flip()
-
-
-def parse_config(config: dict) -> dict:
-    """Return the dictionary config."""
-    for key, value in config.items():
-        value i
-def get_parser() -> argparse.ArgumentParser:
-    """Parser that parses terminal arguments."""
-    import yaml
-
-    parser = argparse.ArgumentParser(description=__doc__)
-    with open("config.yml", "r") as stream:
-        config = yaml.safe_load(stream)
-
-    for key, value in content.items():
-        if isinstance(value, dict):
-            key += "_"
-        parser.add_argument("--" + key, default=value, required=False, nargs="?")
-
-    return parser
+        self.window.screen.blit(self.background, (0, 0))
+        self.renderer.clear()
+        # Forces the next frame to update the whole screen
+        self.dirty_rects = None
 
+    def show(self):
+        """Show the simulation, updating only the rects that changed."""
+        screen = self.window.screen
+        if self.dirty_rects is not None:
+            for rect in self.dirty_rects:
+                screen.blit(self.background, rect, rect)
+        rects = self.show_particles()
+        if self.dirty_rects is None:
+            pygame.display.flip()
+        else:
+            pygame.display.update(self.dirty_rects + rects)
+        self.dirty_rects = rects
+
+    def show_particles(self) -> list:
+        """Show the particles and return the rects they cover."""
+        return self.renderer.draw(self.window, self.particles)
 
 if __name__ == "__main__":
     import sys
 
-    parser = get_parser()
-    config = parser.parse_args(sys.argv[1::])
+    parser = get_parser(__doc__)
+    config = get_settings(parser.parse_args(sys.argv[1::]))
     m = Main(config)
     m()
@@ -0,0 +1,209 @@
+"""Typed settings of the simulations, read from config.yml."""
+
+import argparse
+import dataclasses
+import os
+import pickle
+import tempfile
+
+directory = os.path.dirname(os.path.abspath(__file__))
+config_path = os.path.join(directory, "config.yml")
+# Pickled (schema, path, mtime, size, settings) of the last config file parsed
+settings_path = os.path.join(directory, "data", "settings.dat")
+
+
+class Color(int):
+    """Color given as the integer 0xRRGGBB."""
+
+    @classmethod
+    def parse(cls, value, name: str = "color"):
+        """Return the color of an integer or of a "#RRGGBB" or "0xRRGGBB" string."""
+        if isinstance(value, str):
+            text = value.strip()
+            try:
+                value = int(text[1:], 16) if text.startswith("#") else int(text, 16)
+            except ValueError:
+                raise ValueError(f"{name} n'est pas une couleur hexadécimale : {text}")
+        if isinstance(value, bool) or not isinstance(value, int):
+            raise ValueError(f"{name} n'est pas une couleur hexadécimale : {value!r}")
+        if not 0 <= value <= 0xFFFFFF:
+            raise ValueError(f"{name} n'est pas une couleur entre 0x000000 et 0xffffff")
+        return cls(value)
+
+    def __repr__(self):
+        return f"Color(0x{self:06x})"
+
+
+def parse_float(value, name: str = "value") -> float:
+    """Return value as a float, refusing booleans and non numeric strings."""
+    if isinstance(value, bool):
+        raise ValueError(f"{name} n'est pas un nombre : {value!r}")
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} n'est pas un nombre : {value!r}")
+
+
+def parse_int(value, name: str = "value") -> int:
+    """Return value as an int, refusing booleans and non integer values."""
+    if isinstance(value, bool) or isinstance(value, float) and not value.is_integer():
+        raise ValueError(f"{name} n'est pas un nombre entier : {value!r}")
+    try:
+        return int(value, 0) if isinstance(value, str) else int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} n'est pas un nombre entier : {value!r}")
+
+
+# Functions that convert and validate a value for each type of field
+parsers = {float: parse_float, int: parse_int, Color: Color.parse}
+
+
+class Block:
+    """Base of the frozen dataclasses of the settings.
+
+    Fields are either of a type of parsers or another block, which is a
+    nested block in config.yml and a group of "block_key" options on the
+    command line.
+    """
+
+    @classmethod
+    def from_dict(cls, config: dict, prefix: str = ""):
+        """Return the block of the dictionary config, validating every value."""
+        if not isinstance(config, dict):
+            raise ValueError(f"{prefix.rstrip('_') or 'config'} n'est pas un bloc")
+        unknown = set(config) - {field.name for field in dataclasses.fields(cls)}
+        if unknown:
+            raise ValueError("option inconnue : " + ", ".join(prefix + key for key in sorted(unknown)))
+        values = {}
+        for field in dataclasses.fields(cls):
+            name = prefix + field.name
+            if field.name not in config:
+                raise ValueError(f"option manquante : {name}")
+            values[field.name] = parse_field(field, config[field.name], name)
+        return cls(**values)
+
+    def flatten(self, prefix: str = "") -> dict:
+        """Return the dictionary {option: (value, parser)} of the command line options."""
+        options = {}
+        for field in dataclasses.fields(self):
+            value = getattr(self, field.name)
+            if isinstance(value, Block):
+                options.update(value.flatten(prefix + field.name + "_"))
+            else:
+                options[prefix + field.name] = (value, parsers[field.type])
+        return options
+
+    def replace(self, **options):
+        """Return a copy with the options given as in flatten, such as photon_energy=1.
+
+        The values are converted and validated, so they can be strings.
+        """
+        return replace_options(self, options)
+
+
+def replace_options(block: Block, options: dict, prefix: str = "") -> Block:
+    """Return a copy of block with the options of Block.replace, named after prefix."""
+    fields = {field.name: field for field in dataclasses.fields(block)}
+    changes, blocks = {}, {}
+    for key, value in options.items():
+        if key in fields and not isinstance(getattr(block, key), Block):
+            changes[key] = parse_field(fields[key], value, prefix + key)
+            continue
+        name, _, option = key.partition("_")
+        if name not in fields or not isinstance(getattr(block, name), Block):
+            raise ValueError(f"option inconnue : {prefix + key}")
+        blocks.setdefault(name, {})[option] = value
+    for name, block_options in blocks.items():
+        changes[name] = replace_options(getattr(block, name), block_options, prefix + name + "_")
+    return dataclasses.replace(block, **changes)
+
+
+def parse_field(field: dataclasses.Field, value, name: str):
+    """Return value converted to the type of field."""
+    if isinstance(field.type, type) and issubclass(field.type, Block):
+        return field.type.from_dict(value, name + "_")
+    return parsers[field.type](value, name)
+
+
+@dataclasses.dataclass(frozen=True)
+class ParticleSettings(Block):
+    """Particle block of the settings, with the energy in MeV."""
+
+    x: float
+    y: float
+    vx: float
+    vy: float
+    radius: float
+    energy: float
+    color: Color
+
+
+@dataclasses.dataclass(frozen=True)
+class Settings(Block):
+    """Settings of config.yml."""
+
+    dt: float
+    fps: int
+    electron: ParticleSettings
+    photon: ParticleSettings
+    background_color: Color
+    line_color: Color
+
+
+def schema(block: type = Settings) -> tuple:
+    """Return the names and types of the fields of a block and of its nested blocks."""
+    return tuple(
+        (field.name, schema(field.type) if issubclass(field.type, Block) else field.type.__name__)
+        for field in dataclasses.fields(block)
+    )
+
+
+def load_settings(path: str = config_path, cache: str = settings_path) -> Settings:
+    """Return the settings of the config file at path.
+
+    The settings are stored in cache with the schema of the settings and the
+    modification time and size of the file, so that the YAML is only parsed
+    again when the file or the dataclasses change. The cache is replaced
+    atomically, so concurrent runs never read it half written.
+    """
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    key = (schema(), path, stat.st_mtime_ns, stat.st_size)
+    try:
+        with open(cache, "rb") as file:
+            cached = pickle.load(file)
+        if isinstance(cached, tuple) and cached[:4] == key:
+            return cached[4]
+    except Exception:
+        # A missing, corrupt or outdated cache is parsed again
+        pass
+
+    import yaml
+
+    with open(path, "r") as stream:
+        settings = Settings.from_dict(yaml.safe_load(stream) or {})
+    try:
+        descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(cache), suffix=".tmp")
+        try:
+            with os.fdopen(descriptor, "wb") as file:
+                pickle.dump(key + (settings,), file)
+            os.replace(temporary, cache)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+    except OSError:
+        pass
+    return settings
+
+
+def add_arguments(parser: argparse.ArgumentParser, settings: Settings):
+    """Add an option to parser for every setting, with its value as default."""
+    for key, (value, parse) in settings.flatten().items():
+        parser.add_argument("--" + key, default=value, type=parse, required=False)
+
+
+def get_settings(namespace: argparse.Namespace, settings: Settings = None) -> Settings:
+    """Return the settings with the options of a namespace parsed by add_arguments."""
+    settings = load_settings() if settings is None else settings
+    options = {key: getattr(namespace, key) for key in settings.flatten()}
+    return settings.replace(**options)
@@ -0,0 +1,481 @@
+#!/usr/bin/env python
+"""Headless simulation of the Compton scattering of photons on electrons."""
+
+import argparse
+import itertools
+import multiprocessing
+
+import numpy as np
+
+from main import compton_batch, constants
+from settings import Settings, add_arguments, get_settings, load_settings
+
+
+def particle_field(name: str) -> property:
+    """Return a property giving the array of a field of the particles in use."""
+    return property(lambda self: self.data[name][: self.n])
+
+
+class ParticleSystem:
+    """Particles stored as a structure of arrays.
+
+    Every particle is a row of the arrays x, y, vx, vy, energy, radius, color
+    and kind, so that the whole system is integrated in one vectorized step.
+    Only the first n rows are used, the others are spare capacity.
+    """
+
+    PHOTON = 0
+    ELECTRON = 1
+
+    fields = {
+        "x": np.float64,
+        "y": np.float64,
+        "vx": np.float64,
+        "vy": np.float64,
+        "energy": np.float64,
+        "radius": np.float64,
+        "color": np.uint32,
+        "kind": np.uint8,
+        # Index + 1 of the last particle hit, 0 if none
+        "last_hit": np.int64,
+    }
+
+    x = particle_field("x")
+    y = particle_field("y")
+    vx = particle_field("vx")
+    vy = particle_field("vy")
+    energy = particle_field("energy")
+    radius = particle_field("radius")
+    color = particle_field("color")
+    kind = particle_field("kind")
+    last_hit = particle_field("last_hit")
+
+    def __init__(self, capacity: int = 1024):
+        """Create an empty particle system."""
+        self.n = 0
+        self.data = {
+            name: np.zeros(capacity, dtype=dtype)
+            for name, dtype in ParticleSystem.fields.items()
+        }
+        # Keys photon << 32 | electron of the pairs that overlapped at the last step
+        self.touching = np.zeros(0, dtype=np.int64)
+
+    @classmethod
+    def from_config(
+        cls,
+        config: Settings,
+        photons: int = 1,
+        electrons: int = 1,
+        spread: float = 0,
+        rng: np.random.Generator = None,
+    ):
+        """Create the particles of the photon and electron blocks of the config.
+
+        The positions are spread uniformly by spread around the configured
+        ones. The energies of the config are in MeV.
+        """
+        rng = np.random.default_rng() if rng is None else rng
+        system = cls(photons + electrons)
+        MeV = 1e6 * constants.electron_volt
+        for add, block, count in (
+            (system.add_photons, config.photon, photons),
+            (system.add_electrons, config.electron, electrons),
+        ):
+            add(
+                block.x + rng.uniform(-spread, spread, count),
+                block.y + rng.uniform(-spread, spread, count),
+                block.vx,
+                block.vy,
+                block.energy * MeV,
+                block.color,
+                block.radius,
+            )
+        return system
+
+    def __len__(self):
+        """Return the number of particles."""
+        return self.n
+
+    @property
+    def capacity(self):
+        """Return the number of particles that fit without reallocating."""
+        return len(self.data["x"])
+
+    def reserve(self, capacity: int):
+        """Grow the arrays so that they can hold capacity particles."""
+        if capacity <= self.capacity:
+            return
+        capacity = max(capacity, 2 * self.capacity)
+        for name, array in self.data.items():
+            grown = np.zeros(capacity, dtype=array.dtype)
+            grown[: self.n] = array[: self.n]
+            self.data[name] = grown
+
+    def add(
+        self,
+        kind: int,
+        x,
+        y,
+        vx=0,
+        vy=0,
+        energy=0,
+        color=0xFFFF77,
+        radius=0.01,
+    ) -> slice:
+        """Add particles, the arguments being scalars or arrays.
+
+        Return the slice of the rows of the new particles.
+        """
+        values = np.broadcast_arrays(kind, x, y, vx, vy, energy, radius, color)
+        count = values[0].size
+        self.reserve(self.n + count)
+        rows = slice(self.n, self.n + count)
+        for name, value in zip(
+            ("kind", "x", "y", "vx", "vy", "energy", "radius", "color"), values
+        ):
+            self.data[name][rows] = value.reshape(-1)
+        self.n += count
+        return rows
+
+    def add_photons(self, *args, **kwargs) -> slice:
+        """Add photons."""
+        return self.add(ParticleSystem.PHOTON, *args, **kwargs)
+
+    def add_electrons(self, *args, **kwargs) -> slice:
+        """Add electrons."""
+        return self.add(ParticleSystem.ELECTRON, *args, **kwargs)
+
+    @property
+    def photons(self):
+        """Return the indices of the photons."""
+        return np.flatnonzero(self.kind == ParticleSystem.PHOTON)
+
+    @property
+    def electrons(self):
+        """Return the indices of the electrons."""
+        return np.flatnonzero(self.kind == ParticleSystem.ELECTRON)
+
+    def update(self, dt: float):
+        """Move every particle."""
+        self.x[:] += self.vx * dt
+        self.y[:] += self.vy * dt
+
+    def collisions(self):
+        """Return the indices of the electrons and photons that started to overlap.
+
+        The pairs that already overlapped when collisions was last called are
+        left out, so that a photon only interacts with an electron when it
+        first touches it and not on every step it stays inside it. It is
+        meant to be called once per step.
+        """
+        electrons, photons = self.electrons, self.photons
+        i, j = find_collisions(
+            self.x[electrons],
+            self.y[electrons],
+            self.radius[electrons],
+            self.x[photons],
+            self.y[photons],
+            self.radius[photons],
+        )
+        electrons, photons = electrons[i], photons[j]
+        keys = (photons.astype(np.int64) << 32) | electrons
+        new = ~np.isin(keys, self.touching, assume_unique=True)
+        self.touching = keys
+        return electrons[new], photons[new]
+
+    def scatter(self, electrons: np.ndarray, photons: np.ndarray, rng: np.random.Generator):
+        """Apply the Compton scattering to the pairs of electrons and photons.
+
+        The energies are in J and the speed of the photons stands for c. The
+        angle of each photon is sampled from the Klein-Nishina distribution,
+        its energy is shifted by the Compton formula and the electron recoils
+        with the angle psi and the speed V of compton_batch. A photon scatters
+        at most once per step, on the nearest of the electrons it has just
+        touched, as given by collisions.
+        Return the indices of the electrons and photons that scattered and
+        the scattering angles.
+        """
+        fresh = self.energy[photons] > 0
+        electrons, photons = electrons[fresh], photons[fresh]
+        # Sorted by photon, then distance, then electron so that the partner
+        # does not depend on the order of the pairs
+        distance = np.hypot(self.x[electrons] - self.x[photons], self.y[electrons] - self.y[photons])
+        order = np.lexsort((electrons, distance, photons))
+        photons, first = np.unique(photons[order], return_index=True)
+        electrons = electrons[order][first]
+
+        phi = sample_klein_nishina(self.energy[photons], rng)
+        L1, E0, E1, psi, V = compton_batch(phi, constants.hc / self.energy[photons])
+        # The photon is scattered on either side of its direction
+        side = rng.choice((-1.0, 1.0), size=len(photons))
+        angle = np.arctan2(self.vy[photons], self.vx[photons])
+        speed = np.hypot(self.vx[photons], self.vy[photons])
+
+        self.vx[photons] = speed * np.cos(angle + side * phi)
+        self.vy[photons] = speed * np.sin(angle + side * phi)
+        self.energy[photons] = E1
+        self.last_hit[photons] = electrons + 1
+
+        recoil = speed * V / constants.c
+        np.add.at(self.vx, electrons, recoil * np.cos(angle + side * psi))
+        np.add.at(self.vy, electrons, recoil * np.sin(angle + side * psi))
+        np.add.at(self.energy, electrons, E0 - E1)
+        return electrons, photons, phi
+
+class SpatialHash:
+    """Uniform grid over the normalized coordinates of the window.
+
+    The points are sorted by the key of their cell, so that the points of a
+    cell are found with a binary search instead of a scan of every point.
+    """
+
+    neighbors = tuple((dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1))
+
+    def __init__(self, x: np.ndarray, y: np.ndarray, cell_size: float):
+        """Build the grid of the points (x, y) with square cells."""
+        self.cell_size = cell_size
+        keys = self.keys(*self.cells(x, y))
+        self.order = np.argsort(keys, kind="stable")
+        self.sorted_keys = keys[self.order]
+
+    def cells(self, x: np.ndarray, y: np.ndarray):
+        """Return the coordinates of the cells of the points."""
+        cx = np.floor(x / self.cell_size).astype(np.int64)
+        cy = np.floor(y / self.cell_size).astype(np.int64)
+        return cx, cy
+
+    @staticmethod
+    def keys(cx: np.ndarray, cy: np.ndarray) -> np.ndarray:
+        """Return a unique integer for each cell."""
+        return (cx << 32) + cy
+
+    def candidates(self, x: np.ndarray, y: np.ndarray):
+        """Return the pairs of points lying in the same or in adjacent cells.
+
+        i are the indices of the points (x, y) and j the indices of the points
+        of the grid.
+        """
+        cx, cy = self.cells(x, y)
+        keys = np.stack(
+            [self.keys(cx + dx, cy + dy) for dx, dy in SpatialHash.neighbors]
+        ).reshape(-1)
+        starts = np.searchsorted(self.sorted_keys, keys, side="left")
+        counts = np.searchsorted(self.sorted_keys, keys, side="right") - starts
+        total = counts.sum()
+        i = np.repeat(np.tile(np.arange(len(x)), len(SpatialHash.neighbors)), counts)
+        first = np.repeat(starts - (np.cumsum(counts) - counts), counts)
+        j = self.order[first + np.arange(total)]
+        return i, j
+
+
+def sample_klein_nishina(E0: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    """Sample the scattering angles of photons of energies E0 in J.
+
+    The angles follow the Klein-Nishina cross section, sampled by rejection
+    from directions uniform over the sphere.
+    """
+    k = np.asarray(E0, dtype=float) / constants.mec2
+    phi = np.empty(len(k))
+    pending = np.arange(len(k))
+    while len(pending):
+        cos = rng.uniform(-1, 1, len(pending))
+        P = 1 / (1 + k[pending] * (1 - cos))
+        # The cross section is proportional to P^2 (P + 1/P - sin^2), at most 2
+        cross_section = P * P * (P + 1 / P - (1 - cos * cos))
+        accepted = 2 * rng.random(len(pending)) < cross_section
+        phi[pending[accepted]] = np.arccos(cos[accepted])
+        pending = pending[~accepted]
+    return phi
+
+
+def find_collisions(ax, ay, ar, bx, by, br):
+    """Return the pairs (i, j) of overlapping circles of the sets a and b."""
+    empty = np.zeros(0, dtype=np.intp)
+    if len(ax) == 0 or len(bx) == 0:
+        return empty, empty
+    cell_size = ar.max() + br.max()
+    if cell_size <= 0:
+        return empty, empty
+    i, j = SpatialHash(bx, by, cell_size).candidates(ax, ay)
+    dx = ax[i] - bx[j]
+    dy = ay[i] - by[j]
+    radii = ar[i] + br[j]
+    close = dx * dx + dy * dy < radii * radii
+    return i[close], j[close]
+
+
+class Simulation:
+    """Monte Carlo simulation of photons scattering on electrons without display.
+
+    The statistics are histograms of the scattering angles and of the energies
+    of the scattered photons, and the number of electrons that were hit.
+    """
+
+    def __init__(
+        self,
+        config: Settings,
+        photons: int = 1000,
+        electrons: int = 100,
+        spread: float = 0,
+        seed=None,
+        bins: int = 64,
+    ):
+        """Create the particles of the config, spread around their position."""
+        self.dt = config.dt
+        self.rng = np.random.default_rng(seed)
+        self.particles = ParticleSystem.from_config(
+            config, photons, electrons, spread, self.rng
+        )
+        self.angle_bins = np.linspace(0, np.pi, bins + 1)
+        self.energy_bins = np.linspace(
+            0, config.photon.energy * 1e6 * constants.electron_volt, bins + 1
+        )
+        self.angles = np.zeros(bins, dtype=np.int64)
+        self.energies = np.zeros(bins, dtype=np.int64)
+        self.hit = np.zeros(len(self.particles), dtype=bool)
+        self.scatterings = 0
+        self.steps = 0
+
+    def step(self):
+        """Move the particles and scatter the photons that hit an electron."""
+        self.particles.update(self.dt)
+        electrons, photons = self.particles.collisions()
+        if len(photons):
+            electrons, photons, phi = self.particles.scatter(electrons, photons, self.rng)
+            self.angles += np.histogram(phi, self.angle_bins)[0]
+            self.energies += np.histogram(
+                self.particles.energy[photons], self.energy_bins
+            )[0]
+            self.hit[electrons] = True
+            self.scatterings += len(photons)
+        self.steps += 1
+
+    def run(self, steps: int) -> dict:
+        """Run steps steps and return the statistics."""
+        for _ in range(steps):
+            self.step()
+        return self.statistics()
+
+    def statistics(self) -> dict:
+        """Return the statistics of the simulation."""
+        return {
+            "steps": self.steps,
+            "scatterings": self.scatterings,
+            "electrons": int(self.hit.sum()),
+            "angles": self.angles.copy(),
+            "energies": self.energies.copy(),
+            "angle_bins": self.angle_bins,
+            "energy_bins": self.energy_bins,
+        }
+
+
+def run_shard(task: tuple) -> dict:
+    """Run the simulation of one shard of a sweep and return its statistics."""
+    config, overrides, steps, photons, electrons, spread, seed = task
+    config = config.replace(**overrides)
+    return Simulation(config, photons, electrons, spread, seed).run(steps)
+
+
+def merge_statistics(statistics: list) -> dict:
+    """Merge the statistics of shards of the same configuration."""
+    merged = dict(statistics[0], shards=len(statistics))
+    for key in ("scatterings", "electrons", "angles", "energies"):
+        merged[key] = sum(shard[key] for shard in statistics)
+    return merged
+
+
+def sweep(
+    config: Settings,
+    configurations: list,
+    steps: int = 1000,
+    photons: int = 1000,
+    electrons: int = 100,
+    spread: float = 0,
+    shards: int = 1,
+    seed=None,
+    processes: int = None,
+) -> list:
+    """Run the simulation for several configurations over a pool of processes.
+
+    Each configuration is a dictionary of options overriding config, such as
+    {"photon_energy": 1, "dt": 0.05}. It is run in shards independent shards
+    of photons photons whose random streams are spawned from seed, and the
+    statistics of the shards are merged. Return the merged statistics of each
+    configuration.
+    """
+    seeds = np.random.SeedSequence(seed).spawn(len(configurations) * shards)
+    tasks = [
+        (config, overrides, steps, photons, electrons, spread, seeds[i * shards + k])
+        for i, overrides in enumerate(configurations)
+        for k in range(shards)
+    ]
+    with multiprocessing.Pool(processes) as pool:
+        results = pool.map(run_shard, tasks, chunksize=1)
+    return [
+        merge_statistics(results[i * shards : (i + 1) * shards])
+        for i in range(len(configurations))
+    ]
+
+
+def parse_sweep(values: list) -> list:
+    """Return the configurations of a list of "key=value1,value2" strings.
+
+    The configurations are the cartesian product of the values of each key.
+    """
+    keys, choices = [], []
+    for value in values:
+        key, _, options = value.partition("=")
+        keys.append(key)
+        choices.append(options.split(","))
+    return [dict(zip(keys, product)) for product in itertools.product(*choices)]
+
+
+def get_parser(description: str = __doc__) -> argparse.ArgumentParser:
+    """Parser that parses terminal arguments.
+
+    Every setting of config.yml is an option, such as --photon_energy, whose
+    value is validated like in the file.
+    """
+    parser = argparse.ArgumentParser(description=description)
+    add_arguments(parser, load_settings())
+    return parser
+
+
+if __name__ == "__main__":
+    import json
+    import sys
+
+    parser = get_parser()
+    parser.add_argument("--steps", type=int, default=1000)
+    parser.add_argument("--photons", type=int, default=1000)
+    parser.add_argument("--electrons", type=int, default=100)
+    parser.add_argument("--spread", type=float, default=0.5)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--shards", type=int, default=1)
+    parser.add_argument("--processes", type=int)
+    parser.add_argument(
+        "--sweep",
+        action="append",
+        default=[],
+        metavar="KEY=VALUE,...",
+        help="options to sweep, for example --sweep photon_energy=0.1,0.5,1",
+    )
+    config = parser.parse_args(sys.argv[1:])
+    configurations = parse_sweep(config.sweep)
+    results = sweep(
+        get_settings(config),
+        configurations,
+        config.steps,
+        config.photons,
+        config.electrons,
+        config.spread,
+        config.shards,
+        config.seed,
+        config.processes,
+    )
+    for overrides, statistics in zip(configurations, results):
+        statistics = {
+            key: value.tolist() if isinstance(value, np.ndarray) else value
+            for key, value in statistics.items()
+        }
+        print(json.dumps({"config": overrides, **statistics}))